@@ -1,66 +1,198 @@
+import sys
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from IPython.display import set_matplotlib_formats
-set_matplotlib_formats('svg')
 
-def plot_actions(spot_price, action, closing_capacity=None, start=0, end=-1):
+# number of points kept of a plotted series, whatever the visible range
+MAX_POINTS = 2000
+
+
+def _use_svg_inline():
+    """
+    Notes: Render inline figures as svg inside IPython/Jupyter, without importing IPython elsewhere
+    """
+    ipython = sys.modules.get('IPython')
+    shell = ipython.get_ipython() if ipython is not None else None
+    if shell is not None and hasattr(shell, 'run_line_magic'):
+        shell.run_line_magic('config', "InlineBackend.figure_formats = ['svg']")
+
+_use_svg_inline()
+
+
+def lttb(y, threshold=MAX_POINTS):
+    """
+    Notes: Largest-Triangle-Three-Buckets downsampling of an evenly spaced series. The first
+           and last points are kept, every bucket in between keeps the point forming the
+           largest triangle with the point kept before and the mean of the next bucket, so
+           spikes survive the downsampling.
+    ----------
+    Parameters
+    ----------
+    y         : values of the series
+    threshold : number of points to keep (default=2000)
+
+    Returns
+    -------
+    sorted positions of the points kept
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for k in range(threshold - 2):
+        lo, hi = edges[k], edges[k + 1]
+        # mean of the next bucket (the last point for the last bucket)
+        next_lo, next_hi = hi, edges[k + 2] if k + 2 < len(edges) else n
+        mean_x = (next_lo + next_hi - 1) / 2
+        mean_y = y[next_lo:next_hi].mean()
+        x = np.arange(lo, hi)
+        area = np.abs((a - mean_x) * (y[lo:hi] - y[a]) - (a - x) * (mean_y - y[a]))
+        a = kept[k + 1] = lo + int(np.argmax(area))
+    return kept
+
+
+def plot_actions(spot_price, action, closing_capacity=None, start=0, end=-1, path=None, max_points=MAX_POINTS):
     """
-    Notes: Plot where the algorithm charges and discharges
+    Notes: Plot where the algorithm charges and discharges. The charge and discharge markers
+           are drawn as one collection per series and the price and capacity series are
+           downsampled to max_points of the visible range (again whenever it is zoomed), so
+           whole years plot in a few seconds. Over long ranges the actions are shaded in
+           buckets about one pixel wide, so single periods stay visible.
     ----------
     Parameters
     ----------
     spot_price       : dataframe with spot_price & forecast columns
-    action           : discharge if value > 0, charge if value < 0
+    action           : discharge if value > 0, charge if value < 0 (aligned by position with spot_price)
     closing_capacity : plot closing capacity if provided
     start            : start index (default=0)
-    end              : end index (default=300)
-    
+    end              : end index (default=-1)
+    path             : save the figure to this file instead of showing it (default=None)
+    max_points       : number of points kept of the price and capacity series (default=2000)
+
     Returns
     -------
-    plot with discharge and charge verticle lines
+    plot with discharge and charge verticle lines (the path when saved to a file)
     """
-    
+
     def legend_without_duplicate_labels(ax):
         handles, labels = ax.get_legend_handles_labels()
         unique = [(h, l) for i, (h, l) in enumerate(zip(handles, labels)) if l not in labels[:i]]
-        ax.legend(*zip(*unique), fontsize=10)
-        
+        # a fixed location, searching the best one is slow over whole years
+        ax.legend(*zip(*unique), fontsize=10, loc='upper right')
+
+    def shade(ax, lo, hi, discharge_label, charge_label):
+        # the range is split into buckets about one pixel wide and every bucket holding an
+        # action is shaded whole, so periods narrower than a pixel stay visible
+        buckets = max(1, min(hi - lo, int(ax.bbox.width)))
+        edges = np.unique(np.linspace(lo, hi, buckets + 1).astype(np.int64))
+        right = np.minimum(edges[1:], len(index) - 1)
+        positions = np.column_stack([edges[:-1], right, right]).ravel()
+        artists = []
+        for mask, color, label in ((action[lo:hi] > 0, 'red', discharge_label),
+                                   (action[lo:hi] < 0, 'green', charge_label)):
+            flags = np.add.reduceat(mask, edges[:-1] - lo) > 0
+            if flags.any():
+                # a gap point after every bucket keeps the shaded buckets apart
+                where = np.column_stack([flags, flags, np.zeros_like(flags)]).ravel()
+                artists.append(ax.fill_between(index[positions], 0, 1, where=where,
+                                               transform=ax.get_xaxis_transform(), color=color,
+                                               alpha=0.3, lw=0, label=label, zorder=1))
+        return artists
+
+    def plot_markers(ax, discharge_label=None, charge_label=None, charge_style='solid', lw=None):
+        # one collection per series instead of one line per period, runs of periods are
+        # shaded once the visible range is too dense for single lines
+        if len(x) <= max_points / 10:
+            if len(discharge):
+                ax.vlines(discharge, 0, 1, transform=ax.get_xaxis_transform(), colors='red', linestyles='dotted',
+                          label=discharge_label, lw=lw)
+            if len(charge):
+                ax.vlines(charge, 0, 1, transform=ax.get_xaxis_transform(), colors='green', linestyles=charge_style,
+                          label=charge_label, lw=lw)
+            return
+        shaded = [(visible.start, visible.stop)]
+        artists = shade(ax, visible.start, visible.stop, discharge_label, charge_label)
+
+        def refresh(ax):
+            # bucket the range in view again after zooming or panning (adding the shading
+            # can autoscale the axis, which calls back here with the range already shaded)
+            lo, hi = ax.get_xlim()
+            lo = max(visible.start, int(np.searchsorted(numeric_index, lo, side='left')) - 1)
+            hi = min(visible.stop, int(np.searchsorted(numeric_index, hi, side='right')) + 1)
+            if hi - lo > 1 and (lo, hi) != shaded[0]:
+                shaded[0] = (lo, hi)
+                for artist in artists:
+                    artist.remove()
+                artists[:] = shade(ax, lo, hi, discharge_label, charge_label)
+
+        numeric_index = np.asarray(ax.convert_xunits(index))
+        ax.callbacks.connect('xlim_changed', refresh)
+
+    def plot_price(ax, **kwargs):
+        values = spot_price.values
+        kept = lttb(values[visible], max_points) + visible.start
+        line, = ax.plot(index[kept], values[kept], **kwargs)
+
+        def refresh(ax):
+            # downsample the range in view again after zooming or panning
+            lo, hi = ax.get_xlim()
+            lo = max(visible.start, int(np.searchsorted(numeric_index, lo, side='left')) - 1)
+            hi = min(visible.stop, int(np.searchsorted(numeric_index, hi, side='right')) + 1)
+            if hi - lo > 1:
+                kept = lttb(values[lo:hi], max_points) + lo
+                line.set_data(index[kept], values[kept])
+
+        numeric_index = np.asarray(ax.convert_xunits(index))
+        ax.callbacks.connect('xlim_changed', refresh)
+        return line
+
     spot_price = pd.Series(spot_price)
+    index = spot_price.index
+    action = np.asarray(action)
+    visible = range(len(spot_price))[start:end]
+    visible = slice(visible.start, visible.stop)
+    x = index[visible]
+    visible_action = action[visible]
+    discharge = x[visible_action > 0]
+    charge = x[visible_action < 0]
+    lw = 1.5
+
     if closing_capacity is not None:
         closing_capacity = pd.Series(closing_capacity)
         fig, axs = plt.subplots(2, 1, figsize=(14,5), gridspec_kw={'height_ratios': [3, 1]})
-        axs[0].plot(spot_price[start:end], label='Spot Price')
+        plot_price(axs[0], label='Spot Price')
         axs[0].set_ylabel('Spot Price (AUD)', fontsize=10)
-        lw=1.5
-        for xc in spot_price.index[start:end]:
-            if action[xc] > 0:
-                axs[0].axvline(x=xc, c='red', linestyle='dotted', label='Discharge', lw=lw)
-                axs[1].axvline(x=xc, c='red', linestyle='dotted', lw=lw)
-            elif action[xc] < 0:
-                axs[0].axvline(x=xc, c='green', label='Charge', lw=lw)
-                axs[1].axvline(x=xc, c='green', lw=lw)
+        plot_markers(axs[0], 'Discharge', 'Charge', lw=lw)
+        plot_markers(axs[1], lw=lw)
         legend_without_duplicate_labels(axs[0])
         axs[0].set_xlim(spot_price.index[start], spot_price.index[end])
-        capacity = closing_capacity[start:end]
-        pos = capacity - capacity.shift(1) > 0
-        neg = capacity - capacity.shift(1) < 0
-        axs[1].bar(capacity.index[pos],capacity[pos],color='green', align='center')
-        axs[1].bar(capacity.index[neg],capacity[neg],color='red', align='center')
+
+        # capacity bars where it rose (green) or fell (red) since the previous point kept
+        capacity = closing_capacity.values[visible]
+        kept = lttb(capacity, max_points)
+        change = np.diff(capacity[kept], prepend=np.nan)
+        cap_index = closing_capacity.index[visible][kept]
+        axs[1].vlines(cap_index[change > 0], 0, capacity[kept][change > 0], colors='green')
+        axs[1].vlines(cap_index[change < 0], 0, capacity[kept][change < 0], colors='red')
         axs[1].set_ylabel('Capacity (MWh)', fontsize=10)
         axs[1].set_xlim(closing_capacity.index[start], closing_capacity.index[end])
-        
+
     else:
         fig, ax = plt.subplots(figsize=(11,3))
-        plt.plot(spot_price[start:end])
+        plot_price(ax)
         plt.ylabel('Spot Price', fontsize=10)
         plt.xlabel('Datetime', fontsize=10)
-        for xc in spot_price.index[start:end]:
-            if action[xc] > 0:
-                ax.axvline(x=xc, c='red', linestyle='dotted', label='discharge')
-            elif action[xc] < 0:
-                ax.axvline(x=xc, c='green', linestyle='dotted', label='charge')
+        plot_markers(ax, 'discharge', 'charge', charge_style='dotted')
         legend_without_duplicate_labels(ax)
-    plt.tight_layout()    
-    
-    return plt.show()
\ No newline at end of file
+    plt.tight_layout()
+
+    if path is not None:
+        fig.savefig(path)
+        plt.close(fig)
+        return path
+    return plt.show()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+REGIONS = ['vic', 'nsw', 'sa', 'tas']
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+RESULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'results')
+
+
+def _init_worker():
+    """
+    Notes: Import the optimiser once per worker process, registering glpsol
+           there instead of once per job
+    """
+    import battery_optimise
+
+
+def run_region(region, start=None, end=None, data_dir=DATA_DIR, result_dir=RESULT_DIR, solver='glpk', spec=None,
+               processes=1):
+    """
+    Notes: Optimise the dispatch of one region over a date range and write the
+           submission file (datetime, power, capacity)
+    ----------
+    Parameters
+    ----------
+    region     : one of 'vic', 'nsw', 'sa', 'tas'
+    start      : first time stamp to include (default=None, from the beginning)
+    end        : last time stamp to include (default=None, until the end)
+    data_dir   : directory of the region csv files
+    result_dir : directory the submission is written to
+    solver     : solver passed to battery_optimisation
+    spec       : battery specification overrides passed to battery_optimisation,
+                 eg. {'time_interval': 5 / 60} for 5-minute data
+    processes  : worker processes battery_optimisation may start for a decomposed horizon
+                 (default=1, the job solves its windows in turn)
+
+    Returns
+    -------
+    path of the submission file and its total revenue
+    """
+    from battery_optimise import battery_optimisation
+
+    data = pd.read_csv(os.path.join(data_dir, region + '.csv'))
+    if start is not None:
+        data = data[data.time >= start]
+    if end is not None:
+        data = data[data.time <= end]
+    data = data.assign(time=pd.to_datetime(data.time))
+
+    result = battery_optimisation(data.time, data.spot_price, solver=solver, spec=spec, processes=processes)
+    submission = result[['datetime', 'power', 'opening_capacity']]
+    submission.columns = ['datetime', 'power', 'capacity']
+
+    name = region
+    if start is not None or end is not None:
+        name = '_'.join([region, str(start), str(end)]).replace(' ', 'T').replace(':', '')
+    path = os.path.join(result_dir, name + '_submission.csv')
+    submission.to_csv(path, index=False)
+
+    return path, result.revenue.sum()
+
+
+def run_batch(regions, periods=None, workers=2, data_dir=DATA_DIR, result_dir=RESULT_DIR, solver='glpk', spec=None):
+    """
+    Notes: Optimise several regions and date ranges concurrently. Every job runs
+           in a worker process with its own solver, so at most `workers` solver
+           processes run at the same time.
+    ----------
+    Parameters
+    ----------
+    regions    : list of regions
+    periods    : list of (start, end) date ranges (default=None, whole data set)
+    workers    : maximum number of concurrent jobs / solver processes (default=2)
+    data_dir   : directory of the region csv files
+    result_dir : directory the submissions are written to
+    solver     : solver passed to battery_optimisation
+    spec       : battery specification overrides passed to battery_optimisation
+
+    Returns
+    -------
+    dataframe with region, start, end, file and revenue of every job
+    """
+    periods = periods or [(None, None)]
+    os.makedirs(result_dir, exist_ok=True)
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {pool.submit(run_region, region, start, end, data_dir, result_dir, solver, spec): (region, start, end)
+                   for region in regions for start, end in periods}
+        for future in as_completed(futures):
+            region, start, end = futures[future]
+            path, revenue = future.result()
+            print('%s %s - %s: %.0f (%s)' % (region, start, end, revenue, path))
+            rows.append({'region': region, 'start': start, 'end': end, 'file': path, 'revenue': revenue})
+
+    return pd.DataFrame(rows).sort_values(['region', 'start']).reset_index(drop=True)
+
+
+parser = argparse.ArgumentParser(description="Optimise battery dispatch for several regions and write one"
+                                             " submission file per region (datetime, power, capacity).")
+parser.add_argument("--regions", metavar="R", nargs="+", choices=REGIONS, default=REGIONS,
+                    help="Regions to optimise (default: all).")
+parser.add_argument("--period", metavar=("START", "END"), nargs=2, action="append", default=None,
+                    help="Date range to optimise, eg. --period '2021-01-01' '2021-06-30 23:30:00'."
+                         " Can be repeated (default: whole data set).")
+parser.add_argument("--workers", metavar="N", type=int, default=2,
+                    help="Maximum number of solver processes running at once.")
+parser.add_argument("--solver", metavar="S", type=str, default="glpk",
+                    help="Solver passed to battery_optimisation (eg. 'glpk', 'flow', 'dp').")
+parser.add_argument("--interval", metavar="MIN", type=float, default=30,
+                    help="Length of a dispatch interval of the data in minutes (default: 30).")
+parser.add_argument("--data", metavar="DIR", type=str, default=DATA_DIR,
+                    help="Directory of the region csv files.")
+parser.add_argument("--result", metavar="OUT", type=str, default=RESULT_DIR,
+                    help="Directory where the submission files should be stored.")
+
+
+# Execute the codes only if this file is run as main.
+if __name__ == "__main__":
+    args = parser.parse_args()
+    summary = run_batch(args.regions, args.period, workers=args.workers, data_dir=args.data,
+                        result_dir=args.result, solver=args.solver, spec={'time_interval': args.interval / 60})
+    print(summary)
@@ -0,0 +1,75 @@
+import numpy as np
+
+# penalty per MWh away from a required closing capacity
+FINAL_PENALTY = 1e9
+
+
+def dp_dispatch(charge_cost, discharge_revenue, max_charge, max_discharge, max_capacity,
+                initial_capacity=0, final_capacity=None, resolution=1.0):
+    """
+    Notes: Solve the storage arbitrage problem by dynamic programming over a
+           discretised state-of-charge grid. Energy is measured inside the battery,
+           so efficiency and loss factors are folded into the per-period prices.
+           Both stage rewards are linear, which keeps the value function concave
+           on the grid; the best move of every period is therefore "charge up to
+           one level, discharge down to another" and a whole period is one
+           vectorized pass over the grid, O(n * k) in total.
+    ----------
+    Parameters
+    ----------
+    charge_cost       : cost of storing 1 MWh in each period
+    discharge_revenue : revenue of releasing 1 MWh in each period (must not exceed charge_cost)
+    max_charge        : maximum energy stored per period (scalar or array)
+    max_discharge     : maximum energy released per period (scalar or array)
+    max_capacity      : capacity of the battery
+    initial_capacity  : opening capacity of the first period (rounded to the grid)
+    final_capacity    : closing capacity of the last period (default=None, free)
+    resolution        : grid step in MWh (default=1.0)
+
+    Returns
+    -------
+    capacity  : opening capacity of each period
+    charge    : energy stored in each period
+    discharge : energy released in each period
+    """
+    charge_cost = np.asarray(charge_cost, dtype=float)
+    discharge_revenue = np.asarray(discharge_revenue, dtype=float)
+    n = len(charge_cost)
+    k = int(np.floor(max_capacity / resolution + 1e-9)) + 1
+    up = np.broadcast_to(np.floor(np.asarray(max_charge) / resolution + 1e-9).astype(np.int64), (n,))
+    down = np.broadcast_to(np.floor(np.asarray(max_discharge) / resolution + 1e-9).astype(np.int64), (n,))
+    cost = charge_cost * resolution
+    rev = discharge_revenue * resolution
+
+    # backward pass, only the charge/discharge target levels are kept per period
+    state = np.arange(k)
+    charge_to = np.empty(n, dtype=np.int64)
+    discharge_to = np.empty(n, dtype=np.int64)
+    value = np.zeros(k)
+    if final_capacity is not None:
+        # a steep (but still concave) penalty pins the closing capacity
+        value = -FINAL_PENALTY * np.abs(state - final_capacity / resolution)
+    for t in range(n - 1, -1, -1):
+        # marginal value of each extra grid step, non-increasing by concavity
+        marginal = -np.diff(value)
+        charge_to[t] = np.searchsorted(marginal, -cost[t], side='left')
+        discharge_to[t] = np.searchsorted(marginal, -rev[t], side='right')
+        nxt = np.where(state < charge_to[t], np.minimum(charge_to[t], state + up[t]),
+                       np.where(state > discharge_to[t], np.maximum(discharge_to[t], state - down[t]), state))
+        step = nxt - state
+        value = np.where(step > 0, -step * cost[t], -step * rev[t]) + value[nxt]
+
+    # forward pass from the initial capacity
+    levels = np.empty(n + 1, dtype=np.int64)
+    s = min(max(int(round(initial_capacity / resolution)), 0), k - 1)
+    levels[0] = s
+    for t in range(n):
+        if s < charge_to[t]:
+            s = min(charge_to[t], s + up[t])
+        elif s > discharge_to[t]:
+            s = max(discharge_to[t], s - down[t])
+        levels[t + 1] = s
+
+    capacity = levels * resolution
+    step = np.diff(capacity)
+    return capacity[:-1], np.maximum(step, 0), np.maximum(-step, 0)
@@ -0,0 +1,100 @@
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from battery_dp import FINAL_PENALTY
+
+
+def flow_dispatch(charge_cost, discharge_revenue, max_charge, max_discharge, max_capacity,
+                  initial_capacity=0, final_capacity=None):
+    """
+    Notes: Solve the storage arbitrage problem exactly. Measured inside the battery, it
+           is a min-cost flow on a chain: every period stores energy up to max_charge at
+           charge_cost, releases energy up to max_discharge for discharge_revenue and
+           carries at most max_capacity to the next period. Instead of a generic network
+           simplex, the marginal value of stored energy is tracked backwards in time as
+           sorted segments of slope and length: going one period back merges the charge
+           and discharge options into the sorted segments and cuts what the battery
+           cannot hold, then a forward pass from the initial capacity follows the
+           resulting charge and discharge targets. Every period costs O(number of
+           segments), which stays small in practice.
+           Charging and discharging in the same period is never profitable as long
+           as discharge_revenue does not exceed charge_cost.
+    ----------
+    Parameters
+    ----------
+    charge_cost       : cost of storing 1 MWh in each period
+    discharge_revenue : revenue of releasing 1 MWh in each period
+    max_charge        : maximum energy stored per period (scalar or array)
+    max_discharge     : maximum energy released per period (scalar or array)
+    max_capacity      : capacity of the battery
+    initial_capacity  : opening capacity of the first period
+    final_capacity    : closing capacity of the last period (default=None, free)
+
+    Returns
+    -------
+    capacity  : opening capacity of each period
+    charge    : energy stored in each period
+    discharge : energy released in each period
+    """
+    charge_cost = np.asarray(charge_cost, dtype=float)
+    n = len(charge_cost)
+    discharge_revenue = np.broadcast_to(np.asarray(discharge_revenue, dtype=float), (n,)).tolist()
+    up = np.broadcast_to(np.asarray(max_charge, dtype=float), (n,)).tolist()
+    down = np.broadcast_to(np.asarray(max_discharge, dtype=float), (n,)).tolist()
+    cost = charge_cost.tolist()
+
+    # marginal value of stored energy: slopes in ascending order with their lengths,
+    # the highest slope belongs to the first MWh in the battery
+    slopes, lengths = [0.], [float(max_capacity)]
+    if final_capacity is not None:
+        # energy below the closing capacity is priceless, energy above is worthless
+        segments = [(-FINAL_PENALTY, max_capacity - final_capacity), (FINAL_PENALTY, final_capacity)]
+        slopes = [slope for slope, length in segments if length > 0]
+        lengths = [float(length) for slope, length in segments if length > 0]
+    charge_to, discharge_to = [0.] * n, [0.] * n
+    for t in range(n - 1, -1, -1):
+        # charge while a stored MWh is worth more than it costs,
+        # discharge while it is worth less than it earns
+        charge_to[t] = sum(lengths[bisect_right(slopes, cost[t]):])
+        discharge_to[t] = sum(lengths[bisect_left(slopes, discharge_revenue[t]):])
+
+        # merge the charge & discharge arcs
+        for slope, length in ((cost[t], up[t]), (discharge_revenue[t], down[t])):
+            if length > 0:
+                i = bisect_left(slopes, slope)
+                slopes.insert(i, slope)
+                lengths.insert(i, length)
+
+        # cut the energy beyond the storage arc, the most valuable from the top
+        # and the least valuable from the bottom
+        _trim(slopes, lengths, up[t], top=True)
+        _trim(slopes, lengths, down[t], top=False)
+
+    # forward pass from the initial capacity
+    capacity = np.empty(n + 1)
+    s = capacity[0] = initial_capacity
+    for t in range(n):
+        if s < charge_to[t]:
+            s = min(charge_to[t], s + up[t])
+        elif s > discharge_to[t]:
+            s = max(discharge_to[t], s - down[t])
+        capacity[t + 1] = s
+
+    step = np.diff(capacity)
+    return capacity[:-1], np.maximum(step, 0), np.maximum(-step, 0)
+
+
+def _trim(slopes, lengths, amount, top):
+    """
+    Notes: Remove an amount of energy from the top (highest slopes) or the
+           bottom (lowest slopes) of the sorted segments in place
+    """
+    idx = -1 if top else 0
+    while amount > 0 and lengths:
+        if lengths[idx] > amount + 1e-9:
+            lengths[idx] -= amount
+            return
+        amount -= lengths[idx]
+        slopes.pop(idx)
+        lengths.pop(idx)
@@ -1,137 +1,958 @@
+import time
+import warnings
+import tracemalloc
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import linprog
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+try:
+    import highspy
+except ImportError:  # the day-ahead optimiser then re-solves through scipy.optimize.linprog
+    highspy = None
 
 import logging
 logging.getLogger('pyomo.core').setLevel(logging.ERROR)
 
 from pyomo.environ import *
+import pyomo.kernel as pmo
+from pyomo.opt.solver import SystemCallSolver
+from pyomo.solvers.plugins.solvers.persistent_solver import PersistentSolver
 from pyutilib.services import register_executable, registered_executable
 register_executable(name='glpsol')
 
-def battery_optimisation(datetime, spot_price, initial_capacity=0, include_revenue=True, solver: str='glpk'):
+from battery_dp import dp_dispatch
+from battery_flow import flow_dispatch
+from check import Battery
+
+# Battery's technical specification (default values of check.Battery)
+MIN_BATTERY_CAPACITY = 0
+MAX_BATTERY_CAPACITY = Battery.battery_capacity
+MAX_BATTERY_POWER = 150
+MAX_RAW_POWER = Battery.battery_power
+EFFICIENCY = Battery.charge_efficiency
+MLF = Battery.marginal_loss_factor # Marginal Loss Factor
+TIME_INTERVAL = Battery.time_interval # hours per dispatch interval
+
+# the array model of the linear programming solvers grows with the horizon, longer horizons
+# are split into windows of this many periods so memory stays bounded
+MAX_LP_PERIODS = 48 * 365 * 4
+
+
+def battery_spec(spec=None):
     """
-    Determine the optimal charge and discharge behavior of a battery based 
-    in Victoria. Assuming pure foresight of future spot prices over every 
-    half-hour period to maximise the revenue.
-    PS: Assuming no degradation to the battery over the timeline and battery cannot
-        charge and discharge concurrently.
+    Notes: Technical specification of a battery
     ----------
     Parameters
     ----------
-    datetime: a list of time stamp
-    spot_price: a list of spot price of the corresponding time stamp
-    initial_capacit: the initial capacity of the battery
-    solver: the name of the desire linear programming solver (eg. 'glpk', 'mosek', 'gurobi')
+    spec : dictionary overriding check.Battery attributes, eg. {'battery_capacity': 1000}
+           or {'time_interval': 5 / 60} for 5-minute intervals (default=None, the project battery)
 
     Returns
+    -------
+    max capacity, max raw power, charge efficiency, discharge efficiency, marginal loss factor
+    and interval length in hours
+    """
+    battery = Battery(**(spec or {}))
+    return (battery.battery_capacity, battery.battery_power, battery.charge_efficiency,
+            battery.discharge_efficiency, battery.marginal_loss_factor, battery.time_interval)
+
+
+def periods_per_day(spec=None):
+    """
+    Notes: Number of dispatch intervals in one day (48 for half-hour intervals)
+    """
+    interval = battery_spec(spec)[-1]
+    periods = 24 / interval
+    assert abs(periods - round(periods)) < 1e-9, "A day must hold a whole number of intervals!"
+    return int(round(periods))
+
+
+class SolveProfile:
+    """
+    Notes: Wall time of the stages of one solve, the model size, the solver status and
+           the peak memory, returned in result.attrs['profile'] by battery_optimisation.
+           Every finished stage is handed to the hook, eg. to stream it into a log.
+    ----------
+    Parameters
     ----------
-    A dataframe that contains battery's opening capacity for each half-hour period, spot price
-    of each half-hour period and battery's raw power for each half-hour priod
-    """
-    # Battery's technical specification
-    MIN_BATTERY_CAPACITY = 0
-    MAX_BATTERY_CAPACITY = 580
-    MAX_BATTERY_POWER = 150
-    MAX_RAW_POWER = 300
-    INITIAL_CAPACITY = initial_capacity # Default initial capacity will assume to be 0
-    EFFICIENCY = 0.9
-    MLF = 0.991 # Marginal Loss Factor
-    
-    df = pd.DataFrame({'datetime': datetime, 'spot_price': spot_price}).reset_index(drop=True)
-    df['period'] = df.index
-    initial_period = 0
-    final_period = df.index[-1]
-    
-    # Define model and solver
+    hook         : function called as hook(stage, record) after every stage (default=None)
+    trace_memory : also trace the peak python memory of every stage (default=False,
+                   tracing slows the pure python engines down; a tracemalloc trace
+                   already running is reused and left running, with its peak reset)
+    """
+    def __init__(self, hook=None, trace_memory=False):
+        self.hook = hook
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.info = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Notes: Time the enclosed code as one stage (repeated stages are added up)
+        """
+        # a trace the caller already runs is kept running, only its peak is reset
+        started = self.trace_memory and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        elif self.trace_memory:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {'seconds': time.perf_counter() - start}
+            if self.trace_memory:
+                record['peak_mb'] = (tracemalloc.get_traced_memory()[1] - (0 if started else baseline)) / 1024 ** 2
+            if started:
+                tracemalloc.stop()
+            total = self.stages.setdefault(name, {'seconds': 0.})
+            total['seconds'] += record['seconds']
+            if 'peak_mb' in record:
+                total['peak_mb'] = max(total.get('peak_mb', 0.), record['peak_mb'])
+            if self.hook is not None:
+                self.hook(name, record)
+
+    def timed(self, name, function):
+        """
+        Notes: Wrap a function so every call is timed as a stage
+        """
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def update(self, **info):
+        """
+        Notes: Record model size, solver status etc.
+        """
+        self.info.update(info)
+
+    def summary(self):
+        """
+        Notes: Stages, total time, recorded information and the peak resident memory of the process
+        """
+        summary = dict(self.info, stages={name: dict(record) for name, record in self.stages.items()},
+                       seconds=sum(record['seconds'] for record in self.stages.values()))
+        if resource is not None:
+            summary['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return summary
+
+
+def build_battery_lp(spot_price, initial_capacity=0, final_capacity=None, spec=None):
+    """
+    Notes: Build the battery linear programming model directly as arrays.
+           Decision variables are stacked as [capacity, charge_power, discharge_power],
+           each block holding one entry per period.
+    ----------
+    Parameters
+    ----------
+    spot_price       : a list of spot price of each period
+    initial_capacity : the initial capacity of the battery
+    final_capacity   : the closing capacity of the last period (default=None, free)
+    spec             : battery specification overrides, see battery_spec
+
+    Returns
+    -------
+    c          : cost vector of the objective (to be maximised)
+    A_eq, b_eq : capacity constraints (A_eq @ x == b_eq)
+    A_ub, b_ub : over charge & over discharge constraints (A_ub @ x <= b_ub)
+    bounds     : tuple of (lower, upper) bound arrays of x
+    """
+    max_capacity, max_power, charge_eff, discharge_eff, mlf, interval = battery_spec(spec)
+    price = np.asarray(spot_price, dtype=float)
+    n = len(price)
+    period = np.arange(n)
+    capacity, charge, discharge = period, period + n, period + 2 * n
+
+    # objective: revenue from discharging minus cost of charging
+    c = np.concatenate([np.zeros(n),
+                        -price * interval / mlf,
+                        price * interval * discharge_eff * mlf])
+
+    # capacity constraint: the first period opens at the initial capacity,
+    # every other period opens at the closing capacity of the previous one
+    prev = period[1:]
+    rows = np.concatenate([period, prev, prev, prev])
+    cols = np.concatenate([capacity, capacity[:-1], charge[:-1], discharge[:-1]])
+    vals = np.concatenate([np.ones(n), -np.ones(n - 1),
+                           np.full(n - 1, -charge_eff * interval), np.full(n - 1, interval)])
+    A_eq = sp.csr_matrix((vals, (rows, cols)), shape=(n, 3 * n))
+    b_eq = np.zeros(n)
+    b_eq[0] = initial_capacity
+
+    # the last period closes at the final capacity if required
+    if final_capacity is not None:
+        last = sp.csr_matrix(([1., charge_eff * interval, -interval],
+                              ([0, 0, 0], [capacity[-1], charge[-1], discharge[-1]])),
+                             shape=(1, 3 * n))
+        A_eq = sp.vstack([A_eq, last]).tocsr()
+        b_eq = np.append(b_eq, final_capacity)
+
+    # over charge:    charge_power + capacity / charge_eff / interval <= max_capacity / charge_eff / interval
+    # over discharge: discharge_power - capacity / interval <= 0
+    rows = np.concatenate([period, period, period + n, period + n])
+    cols = np.concatenate([charge, capacity, discharge, capacity])
+    vals = np.concatenate([np.ones(n), np.full(n, 1 / charge_eff / interval), np.ones(n), np.full(n, -1 / interval)])
+    A_ub = sp.csr_matrix((vals, (rows, cols)), shape=(2 * n, 3 * n))
+    b_ub = np.concatenate([np.full(n, max_capacity / charge_eff / interval), np.zeros(n)])
+
+    # do not discharge when price is not positive
+    discharge_ub = np.where(price <= 0, 0, max_power)
+    lower = np.concatenate([np.full(n, MIN_BATTERY_CAPACITY), np.zeros(2 * n)])
+    upper = np.concatenate([np.full(n, max_capacity), np.full(n, max_power), discharge_ub])
+
+    return c, A_eq, b_eq, A_ub, b_ub, (lower.astype(float), upper.astype(float))
+
+
+def _environ_model(c, A_eq, b_eq, A_ub, b_ub, bounds):
+    """
+    Notes: The array model as a pyomo.environ ConcreteModel, one linear expression per
+           matrix row, for the solvers which do not accept pyomo.kernel models
+    """
+    lower, upper = bounds
     battery = ConcreteModel()
+    battery.x = Var(RangeSet(0, len(lower) - 1), bounds=lambda battery, j: (float(lower[j]), float(upper[j])))
+
+    def row(A, i):
+        start, end = A.indptr[i], A.indptr[i + 1]
+        return quicksum(float(a) * battery.x[int(j)] for a, j in zip(A.data[start:end], A.indices[start:end]))
+
+    battery.capacity_constraint = Constraint(RangeSet(0, A_eq.shape[0] - 1),
+                                             rule=lambda battery, i: row(A_eq, i) == float(b_eq[i]))
+    battery.power_constraint = Constraint(RangeSet(0, A_ub.shape[0] - 1),
+                                          rule=lambda battery, i: row(A_ub, i) <= float(b_ub[i]))
+    battery.objective = Objective(expr=quicksum(float(c[j]) * battery.x[int(j)] for j in np.flatnonzero(c)),
+                                  sense=maximize)
+    return battery
+
+
+def _solve_pyomo(c, A_eq, b_eq, A_ub, b_ub, bounds, solver, profile=None):
+    """
+    Notes: Hand the array model to a Pyomo solver. Shell solvers (eg. glpk, cbc) get a
+           pyomo.kernel model with matrix constraints, so no per-period Python rule is
+           evaluated while building it, and are profiled as writing the problem file,
+           running the solver executable, reading its solution file and loading it into
+           the model. The other solvers (persistent, direct and APPSI solvers such as
+           'gurobi_persistent' or 'appsi_highs') only accept pyomo.environ models and get
+           the model of _environ_model, which takes longer to build.
+    """
+    profile = profile or SolveProfile()
+    lower, upper = bounds
     opt = SolverFactory(solver)
+    if not isinstance(opt, SystemCallSolver):
+        with profile.stage('model'):
+            battery = _environ_model(c, A_eq, b_eq, A_ub, b_ub, bounds)
+        profile.update(variables=len(lower), constraints=A_eq.shape[0] + A_ub.shape[0],
+                       nonzeros=int(A_eq.nnz + A_ub.nnz + np.count_nonzero(c)))
+        if isinstance(opt, PersistentSolver):
+            opt.set_instance(battery)
+            with profile.stage('solve'):
+                results = opt.solve(tee=False)
+        else:
+            with profile.stage('solve'):
+                results = opt.solve(battery, tee=False)
+        profile.update(status=str(results.solver.status), termination=str(results.solver.termination_condition))
+        with profile.stage('unpack'):
+            return np.fromiter((battery.x[j].value for j in range(len(lower))), dtype=float, count=len(lower))
 
-    # defining components of the objective model
-    # battery parameters
-    battery.Period = Set(initialize=list(df.period), ordered=True)
-    battery.Price = Param(initialize=list(df.spot_price), within=Any)
-
-    # battery varaibles
-    battery.Capacity = Var(battery.Period, bounds=(MIN_BATTERY_CAPACITY, MAX_BATTERY_CAPACITY))
-    battery.Charge_power = Var(battery.Period, bounds=(0, MAX_RAW_POWER))
-    battery.Discharge_power = Var(battery.Period, bounds=(0, MAX_RAW_POWER))
-
-    # Set constraints for the battery
-    # Defining the battery objective (function to be maximise)
-    def maximise_profit(battery):
-        rev = sum(df.spot_price[i] * (battery.Discharge_power[i] / 2 * EFFICIENCY) * MLF for i in battery.Period)
-        cost = sum(df.spot_price[i] * (battery.Charge_power[i] / 2) / MLF for i in battery.Period)
-        return rev - cost
-
-    # Make sure the battery does not charge above the limit
-    def over_charge(battery, i):
-        return battery.Charge_power[i] <= (MAX_BATTERY_CAPACITY - battery.Capacity[i]) * 2 / EFFICIENCY
-
-    # Make sure the battery discharge the amount it actually has
-    def over_discharge(battery, i):
-        return battery.Discharge_power[i] <= battery.Capacity[i] * 2
-
-    # Make sure the battery do not discharge when price are not positive
-    def negative_discharge(battery, i):
-        # if the spot price is not positive, suppress discharge
-        if battery.Price.extract_values_sparse()[None][i] <= 0:
-            return battery.Discharge_power[i] == 0
-
-        # otherwise skip the current constraint    
-        return Constraint.Skip
-
-    # Defining capacity rule for the battery
-    def capacity_constraint(battery, i):
-        # Assigning battery's starting capacity at the beginning
-        if i == battery.Period.first():
-            return battery.Capacity[i] == INITIAL_CAPACITY
-        # if not update the capacity normally    
-        return battery.Capacity[i] == (battery.Capacity[i-1] 
-                                        + (battery.Charge_power[i-1] / 2 * EFFICIENCY) 
-                                        - (battery.Discharge_power[i-1] / 2))
-
-    # Set constraint and objective for the battery
-    battery.capacity_constraint = Constraint(battery.Period, rule=capacity_constraint)
-    battery.over_charge = Constraint(battery.Period, rule=over_charge)
-    battery.over_discharge = Constraint(battery.Period, rule=over_discharge)
-    battery.negative_discharge = Constraint(battery.Period, rule=negative_discharge)
-    battery.objective = Objective(rule=maximise_profit, sense=maximize)
-
-    # Maximise the objective
-    opt.solve(battery, tee=False)
+    with profile.stage('model'):
+        battery = pmo.block()
+        battery.x = pmo.variable_list(pmo.variable(lb=lb, ub=ub) for lb, ub in zip(lower, upper))
+        battery.revenue = pmo.variable()
+
+        # the objective is written as one extra row: revenue - c @ x == 0
+        A_obj = sp.hstack([sp.csr_matrix(-c.reshape(1, -1)), sp.csr_matrix(([1.], ([0], [0])), shape=(1, 1))])
+        battery.capacity_constraint = pmo.matrix_constraint(A_eq, rhs=b_eq, x=list(battery.x))
+        battery.power_constraint = pmo.matrix_constraint(A_ub, ub=b_ub, x=list(battery.x))
+        battery.revenue_constraint = pmo.matrix_constraint(A_obj.tocsr(), rhs=0,
+                                                           x=list(battery.x) + [battery.revenue])
+        battery.objective = pmo.objective(battery.revenue, sense=pmo.maximize)
+    profile.update(variables=len(lower) + 1, constraints=A_eq.shape[0] + A_ub.shape[0] + 1,
+                   nonzeros=int(A_eq.nnz + A_ub.nnz + np.count_nonzero(c) + 1))
+
+    stages = {'_presolve': 'write', '_apply_solver': 'solve', '_postsolve': 'read'}
+    if all(hasattr(opt, method) for method in stages):
+        for method, name in stages.items():
+            setattr(opt, method, profile.timed(name, getattr(opt, method)))
+        # the solution is loaded into the model separately so that it is timed as its own stage
+        results = opt.solve(battery, tee=False, load_solutions=False)
+        with profile.stage('load'):
+            if len(results.solution):
+                battery.load_solution(results.solution(0))
+    else:
+        with profile.stage('solve'):
+            results = opt.solve(battery, tee=False)
+    profile.update(status=str(results.solver.status), termination=str(results.solver.termination_condition))
+
+    with profile.stage('unpack'):
+        return np.fromiter((v.value for v in battery.x), dtype=float, count=len(lower))
+
+
+def _solve_highs(c, A_eq, b_eq, A_ub, b_ub, bounds, profile=None):
+    """
+    Notes: Solve the array model in process with HiGHS through scipy.optimize.linprog,
+           no problem file is written and no solver process is started.
+
+    Returns
+    -------
+    x     : primal solution
+    duals : dictionary of dual values ('eq', 'ub', 'lower', 'upper'), the change of the
+            maximised revenue per unit increase of each right hand side or bound
+    """
+    profile = profile or SolveProfile()
+    lower, upper = bounds
+    profile.update(variables=len(lower), constraints=A_eq.shape[0] + A_ub.shape[0],
+                   nonzeros=int(A_eq.nnz + A_ub.nnz + np.count_nonzero(c)))
+    with profile.stage('solve'):
+        # linprog minimises, so the revenue is negated
+        res = linprog(-c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=b_eq, bounds=np.column_stack([lower, upper]),
+                      method='highs')
+    profile.update(status='ok' if res.status == 0 else 'error', termination=res.message)
+    assert res.status == 0, 'HiGHS did not find an optimal solution: %s' % res.message
+
+    with profile.stage('unpack'):
+        duals = {'eq': -res.eqlin.marginals, 'ub': -res.ineqlin.marginals,
+                 'lower': -res.lower.marginals, 'upper': -res.upper.marginals}
+        return res.x, duals
+
+
+def _highs_model(c, A_eq, b_eq, A_ub, b_ub, bounds):
+    """
+    Notes: HiGHS instance holding the array model (revenue maximised). Costs and bounds changed
+           in place between solves keep the basis, so the next solve starts from it.
+    """
+    lower, upper = bounds
+    A = sp.vstack([A_eq, A_ub]).tocsc()
+    lp = highspy.HighsLp()
+    lp.num_col_, lp.num_row_ = A.shape[1], A.shape[0]
+    lp.col_cost_, lp.col_lower_, lp.col_upper_ = c, lower, upper
+    lp.row_lower_ = np.concatenate([b_eq, np.full(A_ub.shape[0], -highspy.kHighsInf)])
+    lp.row_upper_ = np.concatenate([b_eq, b_ub])
+    lp.sense_ = highspy.ObjSense.kMaximize
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+    lp.a_matrix_.start_, lp.a_matrix_.index_, lp.a_matrix_.value_ = A.indptr, A.indices, A.data
+    h = highspy.Highs()
+    h.setOptionValue('output_flag', False)
+    h.passModel(lp)
+    return h
+
+
+def _format_result(datetime, spot_price, charge_power, discharge_power, capacity, include_revenue=True, spec=None):
+    """
+    Notes: Assemble the result dataframe of battery_optimisation from solution arrays
+    """
+    _, _, _, discharge_eff, mlf, interval = battery_spec(spec)
+    result = pd.DataFrame({'datetime': datetime, 'spot_price': np.asarray(spot_price, dtype=float),
+                           'charge_power': charge_power, 'discharge_power': discharge_power,
+                           'opening_capacity': capacity})
 
-    # unpack results
-    charge_power, discharge_power, capacity, spot_price = ([] for i in range(4))
-    for i in range(battery.Period.first(), battery.Period.last() + 1):
-        charge_power.append(battery.Charge_power[i].value)
-        discharge_power.append(battery.Discharge_power[i].value)
-        capacity.append(battery.Capacity[i].value)
-        spot_price.append(battery.Price.extract_values_sparse()[None][i])
-
-    result = pd.DataFrame({'datetime':datetime, 'spot_price':spot_price, 'charge_power':charge_power,
-                           'discharge_power':discharge_power, 'opening_capacity':capacity})
-    
     # make sure it does not discharge & charge at the same time
-    if not len(result[(result.charge_power != 0) & (result.discharge_power != 0)]) == 0:
+    if np.any((charge_power != 0) & (discharge_power != 0)):
         print('Ops! The battery discharges & charges concurrently, the result has been returned')
         return result
-    
+
     # convert columns charge_power & discharge_power to power
-    result['power'] = np.where((result.charge_power > 0), 
-                                -result.charge_power, 
-                                result.discharge_power)
-    
+    power = np.where(charge_power > 0, -charge_power, discharge_power)
+
     # calculate market dispatch
-    result['market_dispatch'] = np.where(result.power < 0,
-                                         result.power / 2,
-                                         result.power / 2 * EFFICIENCY)
-    
-    result = result[['datetime', 'spot_price', 'power', 'market_dispatch', 'opening_capacity']]
-    
+    market_dispatch = np.where(power < 0, power * interval, power * interval * discharge_eff)
+
+    result = pd.DataFrame({'datetime': result.datetime, 'spot_price': result.spot_price, 'power': power,
+                           'market_dispatch': market_dispatch, 'opening_capacity': capacity})
+
     # calculate revenue
     if include_revenue:
-        result['revenue'] = np.where(result.market_dispatch < 0, 
-                              result.market_dispatch * result.spot_price / MLF,
-                              result.market_dispatch * result.spot_price * MLF)
-    
-    return result
\ No newline at end of file
+        result['revenue'] = np.where(market_dispatch < 0,
+                                     market_dispatch * result.spot_price / mlf,
+                                     market_dispatch * result.spot_price * mlf)
+
+    return result
+
+
+def _solve_storage(engine, spot_price, initial_capacity=0, spec=None, profile=None, wear_cost=0., import_cost=0.,
+                   max_import=None, max_export=None, **kwargs):
+    """
+    Notes: Solve the battery model with a storage engine (dp_dispatch or flow_dispatch)
+           and convert stored/released energy back to raw power. wear_cost is charged per
+           MWh released from storage, eg. the price of a cycling budget, and import_cost per
+           MWh charged from the grid. max_import and max_export (MW, scalar or per period)
+           cap the charge power and the exported discharge power (after losses) below the
+           battery power, eg. a share of a grid connection.
+    """
+    profile = profile or SolveProfile()
+    max_capacity, max_power, charge_eff, discharge_eff, mlf, interval = battery_spec(spec)
+    with profile.stage('build'):
+        price = np.asarray(spot_price, dtype=float)
+        charge_power = max_power if max_import is None else np.clip(max_import, 0, max_power)
+        discharge_power = max_power if max_export is None else np.clip(max_export / discharge_eff, 0, max_power)
+        problem = dict(charge_cost=(price / mlf + import_cost) / charge_eff,
+                       discharge_revenue=price * discharge_eff * mlf - wear_cost,
+                       max_charge=charge_power * interval * charge_eff,
+                       # do not discharge when price is not positive
+                       max_discharge=np.where(price <= 0, 0, discharge_power * interval),
+                       max_capacity=max_capacity,
+                       initial_capacity=initial_capacity)
+    n = len(price)
+    if engine is flow_dispatch:
+        profile.update(variables=n)
+    else:
+        profile.update(variables=n, states=int(np.floor(max_capacity / kwargs.get('resolution', 1.0) + 1e-9)) + 1)
+    with profile.stage('solve'):
+        capacity, charge, discharge = engine(**problem, **kwargs)
+    profile.update(status='ok', termination='optimal')
+    with profile.stage('unpack'):
+        return capacity, charge / interval / charge_eff, discharge / interval
+
+
+def _dispatch(spot_price, initial_capacity=0, final_capacity=None, solver: str='glpk', resolution=1.0, spec=None,
+              profile=None, duals=None):
+    """
+    Notes: Solve the battery model with the requested engine, the in-process 'highs'
+           solver also fills the duals dictionary when one is provided
+
+    Returns
+    -------
+    opening capacity, charge power and discharge power arrays
+    """
+    profile = profile or SolveProfile()
+    spot_price = np.asarray(spot_price, dtype=float)
+    n = len(spot_price)
+
+    # fall back to the in-process HiGHS solver when glpsol is not installed
+    if solver == 'glpk' and registered_executable('glpsol') is None:
+        print('glpsol is not available, the HiGHS solver is used instead')
+        solver = 'highs'
+    profile.update(engine=solver, periods=n)
+
+    if solver == 'dp':
+        return _solve_storage(dp_dispatch, spot_price, initial_capacity, spec, profile,
+                              final_capacity=final_capacity, resolution=resolution)
+    if solver == 'flow':
+        return _solve_storage(flow_dispatch, spot_price, initial_capacity, spec, profile,
+                              final_capacity=final_capacity)
+
+    # Build the model as arrays and maximise the objective
+    with profile.stage('build'):
+        model = build_battery_lp(spot_price, initial_capacity=initial_capacity, final_capacity=final_capacity,
+                                 spec=spec)
+    if solver == 'highs':
+        x, highs_duals = _solve_highs(*model, profile=profile)
+        if duals is not None:
+            duals.update(highs_duals)
+    else:
+        x = _solve_pyomo(*model, solver=solver, profile=profile)
+
+    # unpack results
+    return x[:n], x[n:2 * n], x[2 * n:]
+
+
+def _revenue(spot_price, charge_power, discharge_power, spec=None):
+    """
+    Notes: Total revenue of a dispatch
+    """
+    _, _, _, discharge_eff, mlf, interval = battery_spec(spec)
+    return float(np.sum(spot_price * interval * (discharge_power * discharge_eff * mlf - charge_power / mlf)))
+
+
+def _closing_capacity(capacity, charge_power, discharge_power, spec=None):
+    """
+    Notes: Closing capacity of the last period
+    """
+    _, _, charge_eff, _, _, interval = battery_spec(spec)
+    return float(capacity[-1] + (charge_power[-1] * charge_eff - discharge_power[-1]) * interval)
+
+
+def _solve_window(args):
+    """
+    Notes: Worker of the temporal decomposition, solve one window of the horizon
+    """
+    spot_price, initial_capacity, final_capacity, solver, resolution, spec = args
+    return _dispatch(spot_price, initial_capacity, final_capacity, solver, resolution, spec)
+
+
+def _reachable(spot_price, initial_capacity, spec=None):
+    """
+    Notes: Lowest and highest closing capacity reachable over the periods from the initial
+           capacity, charging or discharging at full power (no discharge when the price is
+           not positive)
+    """
+    max_capacity, max_power, charge_eff, _, _, interval = battery_spec(spec)
+    spot_price = np.asarray(spot_price, dtype=float)
+    highest = min(max_capacity, initial_capacity + len(spot_price) * max_power * interval * charge_eff)
+    lowest = max(0., initial_capacity - np.count_nonzero(spot_price > 0) * max_power * interval)
+    return lowest, highest
+
+
+def _decomposed_dispatch(spot_price, initial_capacity, window, overlap, solver, resolution, processes, spec=None):
+    """
+    Notes: Split the horizon into windows and solve them in a process pool (in turn for processes=1).
+           1) every window is solved with `overlap` periods of look-back (starting empty)
+              and look-ahead; its capacity at the end of the window becomes the boundary
+           2) every window is solved again from its opening boundary to its closing
+              boundary, so the stitched windows form one feasible dispatch. A boundary
+              the window cannot reach from its opening boundary (eg. over periods of
+              non-positive prices, where discharging is not allowed) is moved to the
+              nearest reachable capacity with a warning.
+    """
+    if overlap < 0:
+        raise ValueError('overlap must not be negative, got %s' % overlap)
+    n = len(spot_price)
+    starts = list(range(0, n, window))
+    ends = starts[1:] + [n]
+
+    # a single process solves the windows in turn instead of starting a pool
+    pool = ProcessPoolExecutor(max_workers=processes) if processes != 1 else None
+    solve_windows = map if pool is None else pool.map
+    try:
+        # 1) boundary capacity at the end of every window but the last
+        jobs = []
+        for k, (start, end) in enumerate(zip(starts[:-1], ends[:-1])):
+            lo = 0 if k == 0 else max(0, start - overlap)
+            jobs.append((spot_price[lo:min(n, end + overlap)], initial_capacity if k == 0 else 0,
+                         None, solver, resolution, spec))
+        boundary = [initial_capacity]
+        for (start, end), (capacity, charge_power, discharge_power) in zip(zip(starts, ends),
+                                                                           solve_windows(_solve_window, jobs)):
+            lo = 0 if start == 0 else max(0, start - overlap)
+            if end - lo < len(capacity):
+                boundary.append(float(capacity[end - lo]))
+            else:
+                # no look-ahead, the window closes the solve
+                boundary.append(_closing_capacity(capacity, charge_power, discharge_power, spec))
+
+        # the opening boundary of a window is the closing boundary of the previous one
+        for k, (start, end) in enumerate(zip(starts[:-1], ends[:-1])):
+            lowest, highest = _reachable(spot_price[start:end], boundary[k], spec)
+            target = min(max(boundary[k + 1], lowest), highest)
+            if abs(target - boundary[k + 1]) > 1e-9:
+                warnings.warn('The boundary capacity %.4f of the window ending at period %d cannot be reached, '
+                              '%.4f is used instead' % (boundary[k + 1], end, target))
+                boundary[k + 1] = target
+        boundary.append(None)
+
+        # 2) stitch the windows on the boundary capacities
+        jobs = [(spot_price[start:end], boundary[k], boundary[k + 1], solver, resolution, spec)
+                for k, (start, end) in enumerate(zip(starts, ends))]
+        solutions = list(solve_windows(_solve_window, jobs))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return [np.concatenate(part) for part in zip(*solutions)]
+
+
+def _initial_capacity_slopes(spot_price, initial_capacity, revenue, spec=None, step=1e-3):
+    """
+    Notes: Revenue per MWh of a little more and of a little less initial capacity, from exact
+           flow solves with the initial capacity moved by step MWh (nan beyond the limits).
+           The revenue is concave in the initial capacity, so at a degenerate solution the
+           two sides differ and a single dual is only one of them.
+    """
+    max_capacity = battery_spec(spec)[0]
+    slopes = []
+    for sign in (1, -1):
+        moved = initial_capacity + sign * step
+        if not 0 <= moved <= max_capacity:
+            slopes.append(np.nan)
+            continue
+        _, charge_power, discharge_power = _solve_storage(flow_dispatch, spot_price, moved, spec)
+        slopes.append(sign * (_revenue(spot_price, charge_power, discharge_power, spec) - revenue) / step)
+    return slopes
+
+
+def _add_duals(result, duals, spot_price, charge_power, discharge_power, initial_capacity=0, spec=None):
+    """
+    Notes: Dual value columns of the capacity, over charge and over discharge constraints, and
+           result.attrs['sensitivity'] with the marginal revenue of the initial capacity and of
+           the capacity and power limits (summing the duals of every row and bound they enter).
+           The duals are those of the vertex HiGHS returns, at a degenerate vertex they are one
+           side of the marginal revenue only, so both sides of the initial capacity are added.
+    """
+    max_capacity, max_power, charge_eff, _, _, interval = battery_spec(spec)
+    n = len(spot_price)
+    over_charge, over_discharge, upper = duals['ub'][:n], duals['ub'][n:2 * n], duals['upper']
+    result['capacity_dual'] = duals['eq'][:n]
+    result['over_charge_dual'] = over_charge
+    result['over_discharge_dual'] = over_discharge
+
+    # max_capacity / charge_eff / interval is the right hand side of the over charge rows and
+    # max_capacity the upper bound of the capacity, max_power bounds the power (discharge only
+    # when the price is positive)
+    capacity_value = float(over_charge.sum() / charge_eff / interval + upper[:n].sum())
+    power_bounds = np.concatenate([upper[n:2 * n], upper[2 * n:][spot_price > 0]])
+    power_value = float(power_bounds.sum())
+    revenue = _revenue(spot_price, charge_power, discharge_power, spec)
+    initial_up, initial_down = _initial_capacity_slopes(spot_price, initial_capacity, revenue, spec)
+    result.attrs['sensitivity'] = {
+        'initial_capacity': float(duals['eq'][0]), 'initial_capacity_up': initial_up,
+        'initial_capacity_down': initial_down, 'battery_capacity': capacity_value, 'battery_power': power_value,
+        # % revenue change per % change of the limit
+        'capacity_elasticity': capacity_value * max_capacity / revenue if revenue else np.nan,
+        'power_elasticity': power_value * max_power / revenue if revenue else np.nan,
+        'binding_over_charge': int(np.sum(over_charge > 1e-9)),
+        'binding_over_discharge': int(np.sum(over_discharge > 1e-9)), 'binding_power': int(np.sum(power_bounds > 1e-9))}
+
+
+def battery_optimisation(datetime, spot_price, initial_capacity=0, include_revenue=True, solver: str='glpk',
+                         resolution=1.0, window=None, overlap=None, processes=None, compare=False, spec=None,
+                         profile_hook=None, trace_memory=False, duals=False):
+    """
+    Determine the optimal charge and discharge behavior of a battery based
+    in Victoria. Assuming pure foresight of future spot prices over every
+    dispatch interval (half-hour by default) to maximise the revenue.
+    PS: Assuming no degradation to the battery over the timeline and battery cannot
+        charge and discharge concurrently.
+    ----------
+    Parameters
+    ----------
+    datetime: a list of time stamp
+    spot_price: a list of spot price of the corresponding time stamp
+    initial_capacit: the initial capacity of the battery
+    solver: the name of the desire linear programming solver (eg. 'glpk', 'mosek', 'gurobi',
+            or persistent/APPSI solvers such as 'gurobi_persistent' or 'appsi_highs'),
+            or 'highs' for HiGHS solving the array model in process (no LP file or
+            subprocess, used instead of 'glpk' when glpsol is not installed),
+            or 'dp' for the dynamic programming engine which needs no external solver,
+            or 'flow' for the exact min-cost-flow engine which needs no external solver
+    resolution: state of charge grid step in MWh, only used by the 'dp' engine
+    window: split the horizon into windows of this many periods (eg. 48*30) and solve
+            them in parallel (default=None, solve the whole horizon at once; linear
+            programming solvers use windows of MAX_LP_PERIODS beyond that length, with a warning)
+    overlap: number of periods each window looks back and ahead to find its boundary
+             capacity (default=None, 3 days of intervals)
+    processes: number of worker processes of the decomposition (default=None, all cores,
+               or 1 when the windows of MAX_LP_PERIODS are used without a window given)
+    compare: also solve the whole horizon at once and report the revenue gap of the
+             decomposition in result.attrs['decomposition'], which otherwise holds the
+             window, the overlap and the number of windows
+    spec: dictionary overriding the battery specification of check.Battery,
+          eg. {'battery_capacity': 1000, 'battery_power': 500}, or {'time_interval': 5 / 60}
+          for 5-minute intervals (default=None)
+    profile_hook: function called as profile_hook(stage, record) after every stage of the
+                  solve, eg. to stream the timings into a log (default=None)
+    trace_memory: also trace the peak python memory of every stage (default=False)
+    duals: add the dual values of the capacity, over charge and over discharge constraints
+           (revenue per unit of each right hand side) as the capacity_dual, over_charge_dual
+           and over_discharge_dual columns, and their sensitivity summary in
+           result.attrs['sensitivity']; the duals are read from the 'highs' solver, which is
+           used whatever the solver (default=False)
+
+    Returns
+    ----------
+    A dataframe that contains battery's opening capacity for each period, spot price
+    of each period and battery's raw power for each period. result.attrs['profile'] holds
+    the time of every stage (build, model, write, solve, read, load, unpack, format), the
+    model size (variables, constraints, nonzeros), the solver status and the peak memory.
+    With duals, result.attrs['sensitivity'] holds the dual values of the initial capacity (per
+    MWh), of the battery capacity (per MWh) and of the battery power (per MW), the elasticities
+    of the revenue to both limits and the number of binding constraints. The duals belong to
+    the vertex HiGHS returns and are one-sided when it is degenerate (a supergradient of the
+    revenue), so the marginal revenue of one more and one less MWh of initial capacity are
+    also given as initial_capacity_up and initial_capacity_down (nan beyond the limits).
+    """
+    profile = SolveProfile(profile_hook, trace_memory)
+    spot_price = np.asarray(spot_price, dtype=float)
+    if overlap is None:
+        overlap = int(round(3 * 24 / battery_spec(spec)[-1]))
+    if duals and solver != 'highs':
+        print('The duals are read from HiGHS, it is used instead of %s' % solver)
+        solver = 'highs'
+    automatic = window is None and solver not in ('dp', 'flow') and len(spot_price) > MAX_LP_PERIODS and not duals
+    if automatic:
+        # the caller did not ask for a decomposition, so it does not start a pool either
+        window = MAX_LP_PERIODS
+        processes = 1 if processes is None else processes
+        warnings.warn('%d periods are more than MAX_LP_PERIODS, the horizon is solved in windows of %d periods '
+                      'with an overlap of %d, the schedule may be suboptimal (pass compare=True for the gap, '
+                      "or use the 'flow' engine for the exact optimum)" % (len(spot_price), window, overlap))
+
+    if window is None or len(spot_price) <= window:
+        dual_values = {} if duals else None
+        capacity, charge_power, discharge_power = _dispatch(spot_price, initial_capacity, solver=solver,
+                                                            resolution=resolution, spec=spec, profile=profile,
+                                                            duals=dual_values)
+        with profile.stage('format'):
+            result = _format_result(datetime, spot_price, charge_power, discharge_power, capacity,
+                                    include_revenue=include_revenue, spec=spec)
+            if duals:
+                _add_duals(result, dual_values, spot_price, charge_power, discharge_power, initial_capacity, spec)
+        result.attrs['profile'] = profile.summary()
+        return result
+
+    assert not duals, "The duals need the whole horizon in one model, do not pass a window!"
+
+    # the windows are solved in worker processes, which are timed as one stage
+    profile.update(engine=solver, periods=len(spot_price), windows=len(range(0, len(spot_price), window)))
+    with profile.stage('decomposition'):
+        capacity, charge_power, discharge_power = _decomposed_dispatch(spot_price, initial_capacity, window,
+                                                                       overlap, solver, resolution, processes, spec)
+    with profile.stage('format'):
+        result = _format_result(datetime, spot_price, charge_power, discharge_power, capacity,
+                                include_revenue=include_revenue, spec=spec)
+    result.attrs['profile'] = profile.summary()
+    result.attrs['decomposition'] = {'window': window, 'overlap': overlap, 'automatic': automatic,
+                                     'windows': len(range(0, len(spot_price), window))}
+
+    if compare:
+        revenue = _revenue(spot_price, charge_power, discharge_power, spec)
+        _, charge_power, discharge_power = _dispatch(spot_price, initial_capacity, solver=solver,
+                                                     resolution=resolution, spec=spec)
+        monolithic = _revenue(spot_price, charge_power, discharge_power, spec)
+        result.attrs['decomposition'].update(revenue=revenue, monolithic_revenue=monolithic, gap=monolithic - revenue,
+                                             gap_pct=100 * (monolithic - revenue) / abs(monolithic) if monolithic else 0.)
+
+    return result
+
+
+def _scenario_revenue(args):
+    """
+    Notes: Worker of stochastic_optimisation, revenue of the perfect foresight dispatch of one scenario
+    """
+    spot_price, initial_capacity, solver, spec = args
+    _, charge_power, discharge_power = _dispatch(spot_price, initial_capacity, solver=solver, spec=spec)
+    return _revenue(spot_price, charge_power, discharge_power, spec)
+
+
+def stochastic_optimisation(datetime, scenarios, initial_capacity=0, probabilities=None, include_revenue=True,
+                            solver: str='flow', spec=None, foresight=False, processes=None):
+    """
+    Notes: One non-anticipative dispatch maximising the expected revenue over S price scenarios
+           (eg. a forecast ensemble of a day). Every scenario shares the battery constraints and
+           the dispatch, and the revenue is linear in the price, so the scenario-expanded model
+               max sum_s p_s * revenue(dispatch, price_s)
+           has the optimum of the single model on the expected price. It is solved once,
+           whatever S, and the revenue of every scenario is evaluated at once as a matrix product.
+    ----------
+    Parameters
+    ----------
+    datetime         : a list of time stamp
+    scenarios        : matrix of S rows (scenarios) by n columns (periods) of spot prices
+    initial_capacity : the initial capacity of the battery
+    probabilities    : probability of each scenario (default=None, equally likely)
+    include_revenue  : add the expected revenue column (default=True)
+    solver           : solver passed to battery_optimisation (default='flow')
+    spec             : battery specification overrides, see battery_spec
+    foresight        : also solve every scenario with perfect foresight in a process pool, to report
+                       the expected value of perfect information (default=False)
+    processes        : number of worker processes of the foresight solves (default=None, all cores)
+
+    Returns
+    -------
+    The same dataframe as battery_optimisation on the expected spot price. result.attrs['scenarios']
+    holds the number of scenarios, the expected revenue, its standard deviation, minimum,
+    5th and 95th percentiles and maximum over the scenarios (and the foresight revenue and
+    value of perfect information when requested).
+    """
+    scenarios = np.atleast_2d(np.asarray(scenarios, dtype=float))
+    assert scenarios.shape[1] == len(datetime), "scenarios must have one column per period!"
+    if probabilities is None:
+        probabilities = np.full(len(scenarios), 1 / len(scenarios))
+    probabilities = np.asarray(probabilities, dtype=float) / np.sum(probabilities)
+    _, _, _, discharge_eff, mlf, interval = battery_spec(spec)
+
+    expected_price = probabilities @ scenarios
+    capacity, charge_power, discharge_power = _dispatch(expected_price, initial_capacity, solver=solver, spec=spec)
+    result = _format_result(datetime, expected_price, charge_power, discharge_power, capacity,
+                            include_revenue=include_revenue, spec=spec)
+
+    # revenue of the dispatch in every scenario
+    revenue = scenarios @ (interval * (discharge_power * discharge_eff * mlf - charge_power / mlf))
+    expected = float(probabilities @ revenue)
+    order = np.argsort(revenue)
+    quantile = np.cumsum(probabilities[order])
+    summary = {'scenarios': len(scenarios), 'expected_revenue': expected,
+               'std_revenue': float(np.sqrt(probabilities @ (revenue - expected) ** 2)),
+               'min_revenue': float(revenue.min()),
+               'p5_revenue': float(revenue[order][np.searchsorted(quantile, 0.05)]),
+               'p95_revenue': float(revenue[order][min(np.searchsorted(quantile, 0.95), len(order) - 1)]),
+               'max_revenue': float(revenue.max())}
+
+    if foresight:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            foresight_revenue = np.fromiter(pool.map(_scenario_revenue, [(price, initial_capacity, solver, spec)
+                                                                         for price in scenarios]),
+                                            dtype=float, count=len(scenarios))
+        summary['foresight_revenue'] = float(probabilities @ foresight_revenue)
+        summary['value_of_perfect_information'] = summary['foresight_revenue'] - expected
+    result.attrs['scenarios'] = summary
+    return result
+
+
+def dp_gap(spot_price, initial_capacity=0, resolution=1.0, solver: str='glpk'):
+    """
+    Notes: Compare the revenue of the dynamic programming engine with the
+           linear programming optimum
+    ----------
+    Parameters
+    ----------
+    spot_price       : a list of spot price
+    initial_capacity : the initial capacity of the battery
+    resolution       : state of charge grid step in MWh
+    solver           : the linear programming solver used as reference
+
+    Returns
+    -------
+    dictionary of dp revenue, lp revenue, absolute gap and relative gap (%)
+    """
+    datetime = np.arange(len(spot_price))
+    dp_revenue = battery_optimisation(datetime, spot_price, initial_capacity, solver='dp',
+                                      resolution=resolution).revenue.sum()
+    lp_revenue = battery_optimisation(datetime, spot_price, initial_capacity, solver=solver).revenue.sum()
+    gap = lp_revenue - dp_revenue
+    return {'dp_revenue': dp_revenue, 'lp_revenue': lp_revenue, 'gap': gap,
+            'gap_pct': 100 * gap / abs(lp_revenue) if lp_revenue else 0.}
+
+
+class DayAheadOptimiser:
+    """
+    Notes: Reusable day-ahead optimiser for rolling re-optimisation. The array model is
+           built once for a fixed number of periods. With the default 'highs' solver one
+           HiGHS instance (highspy) keeps the model, the costs, discharge bounds and initial
+           capacity of the day are changed in place and every day is re-solved from the
+           basis of the previous day (no LP file, no solver process; without highspy the
+           arrays are re-solved cold through scipy).
+           Pyomo solvers get one Pyomo model whose spot price and initial capacity are
+           mutable and updated in place between days, and the solver is created once.
+           Persistent solvers (eg. 'gurobi_persistent') keep the model loaded and
+           re-solve from the previous basis, other solvers are warm-started when
+           they support it.
+    ----------
+    Parameters
+    ----------
+    periods          : number of periods optimised at once (default=None, one day of intervals)
+    initial_capacity : the initial capacity of the battery on the first day
+    solver           : 'highs' or the name of a Pyomo linear programming solver, 'glpk' falls
+                       back to 'highs' when glpsol is not installed (default='highs')
+    spec             : battery specification overrides, see battery_spec
+    """
+    def __init__(self, periods=None, initial_capacity=0, solver: str='highs', spec=None):
+        self.periods = periods = periods or periods_per_day(spec)
+        self.closing_capacity = initial_capacity
+        self.spec = spec
+        _, self._max_power, _, discharge_eff, mlf, interval = battery_spec(spec)
+
+        # fall back to the in-process HiGHS solver when glpsol is not installed
+        if solver == 'glpk' and registered_executable('glpsol') is None:
+            print('glpsol is not available, the HiGHS solver is used instead')
+            solver = 'highs'
+        self.solver = solver
+
+        n = periods
+        # cost vector of a price of 1 in every period, scaled by the price of the day
+        self._lp = build_battery_lp(np.ones(n), spec=spec)
+        if solver == 'highs':
+            self.model = None
+            self._highs = _highs_model(*self._lp) if highspy is not None else None
+            return
+        _, A_eq, _, A_ub, b_ub, (lower, upper) = self._lp
+        A_eq, A_ub = A_eq.tocsr(), A_ub.tocsr()
+
+        battery = ConcreteModel()
+        battery.Period = RangeSet(0, n - 1)
+        battery.Price = Param(battery.Period, initialize=0, mutable=True)
+        battery.x = Var(RangeSet(0, 3 * n - 1), bounds=lambda battery, j: (lower[j], upper[j]))
+
+        def row(A, i):
+            start, end = A.indptr[i], A.indptr[i + 1]
+            return sum(a * battery.x[j] for a, j in zip(A.data[start:end], A.indices[start:end]))
+
+        # the first capacity row is enforced by fixing the opening capacity instead
+        battery.capacity_constraint = Constraint(RangeSet(1, n - 1), rule=lambda battery, i: row(A_eq, i) == 0)
+        battery.power_constraint = Constraint(RangeSet(0, 2 * n - 1), rule=lambda battery, i: row(A_ub, i) <= b_ub[i])
+
+        def maximise_profit(battery):
+            rev = sum(battery.Price[i] * (battery.x[2 * n + i] * interval * discharge_eff) * mlf for i in battery.Period)
+            cost = sum(battery.Price[i] * (battery.x[n + i] * interval) / mlf for i in battery.Period)
+            return rev - cost
+        battery.objective = Objective(rule=maximise_profit, sense=maximize)
+
+        self.model = battery
+        self._opt = SolverFactory(solver)
+        self._persistent = isinstance(self._opt, PersistentSolver)
+        self._warmstart = not self._persistent and self._opt.warm_start_capable()
+        self._loaded = False
+
+    def _update(self, spot_price, initial_capacity):
+        battery, n = self.model, self.periods
+        for i in range(n):
+            battery.Price[i] = spot_price[i]
+            # do not discharge when price is not positive
+            battery.x[2 * n + i].setub(0 if spot_price[i] <= 0 else self._max_power)
+        battery.x[0].fix(initial_capacity)
+
+        if not self._persistent:
+            return
+        if not self._loaded:
+            self._opt.set_instance(battery)
+            self._loaded = True
+            return
+        self._opt.update_var(battery.x[0])
+        for i in range(n):
+            self._opt.update_var(battery.x[2 * n + i])
+        self._opt.set_objective(battery.objective)
+
+    def optimise(self, datetime, spot_price, initial_capacity=None, include_revenue=True):
+        """
+        Notes: Optimise the next day. The closing capacity of the previous call is
+               used as initial capacity unless one is provided.
+        ----------
+        Parameters
+        ----------
+        datetime         : a list of time stamp of the day
+        spot_price       : a list of (predicted) spot price of the corresponding time stamp
+        initial_capacity : override the carried over initial capacity
+        include_revenue  : include revenue column in the result
+
+        Returns
+        -------
+        The same dataframe as battery_optimisation
+        """
+        spot_price = np.asarray(spot_price, dtype=float)
+        assert len(spot_price) == self.periods, 'spot_price must have %d periods' % self.periods
+        if initial_capacity is None:
+            initial_capacity = self.closing_capacity
+
+        n = self.periods
+        if self.solver == 'highs':
+            c, A_eq, b_eq, A_ub, b_ub, (lower, upper) = self._lp
+            b_eq, upper = b_eq.copy(), upper.copy()
+            b_eq[0] = initial_capacity
+            # do not discharge when price is not positive
+            upper[2 * n:] = np.where(spot_price <= 0, 0, self._max_power)
+            if self._highs is None:
+                x, _ = _solve_highs(c * np.tile(spot_price, 3), A_eq, b_eq, A_ub, b_ub, (lower, upper))
+            else:
+                # change the day in place, HiGHS starts from the basis of the previous day
+                h, columns = self._highs, np.arange(3 * n, dtype=np.int32)
+                h.changeColsCost(3 * n, columns, c * np.tile(spot_price, 3))
+                h.changeColsBounds(n, columns[2 * n:], lower[2 * n:], upper[2 * n:])
+                h.changeRowBounds(0, initial_capacity, initial_capacity)
+                h.run()
+                status = h.getModelStatus()
+                assert status == highspy.HighsModelStatus.kOptimal, \
+                    'HiGHS did not find an optimal solution: %s' % h.modelStatusToString(status)
+                x = np.asarray(h.getSolution().col_value)
+        else:
+            self._update(spot_price, initial_capacity)
+            if self._persistent:
+                self._opt.solve(tee=False)
+            elif self._warmstart:
+                self._opt.solve(self.model, tee=False, warmstart=True)
+            else:
+                self._opt.solve(self.model, tee=False)
+            x = np.array([self.model.x[j].value for j in range(3 * n)], dtype=float)
+        capacity, charge_power, discharge_power = x[:n], x[n:2 * n], x[2 * n:]
+
+        # hand back the closing capacity for the next day
+        self.closing_capacity = _closing_capacity(capacity, charge_power, discharge_power, self.spec)
+
+        return _format_result(datetime, spot_price, charge_power, discharge_power, capacity,
+                              include_revenue=include_revenue, spec=self.spec)
@@ -4,8 +4,9 @@ import numpy as np
 import pandas as pd
 import argparse
 
-time_interval = 0.5
+time_interval = 0.5  # hours per interval (5-minute settlement: 5 / 60)
 tol = 1e-7
+energy_scale = 10 ** 12  # fixed-point units per MWh
 
 
 class StatusCodes(IntEnum):
@@ -28,16 +29,21 @@ class Battery:
     marginal_loss_factor = 0.991
     fixed_oNm = 8.1
     variable_oNm = 0
+    time_interval = time_interval
 
-    def __init__(self, initial_capacity=0):
+    def __init__(self, initial_capacity=0, **spec):
         """
         Create a battery with specific initial capacity
         :param initial_capacity: The power the battery starts with
+        :param spec: Overrides of the technical specification, eg. battery_capacity=1000 or time_interval=5 / 60
         """
+        for name, value in spec.items():
+            assert hasattr(Battery, name), "Unknown battery specification: %s" % name
+            setattr(self, name, value)
         assert 0 <= initial_capacity <= self.battery_capacity, "Enter valid initial capacity!"
         self.capacity = initial_capacity
-        self.max_charge = -min(self.battery_power, (self.battery_capacity - self.capacity) / self.charge_efficiency / time_interval)
-        self.max_discharge = min(self.battery_power, self.capacity / time_interval)
+        self.max_charge = -min(self.battery_power, (self.battery_capacity - self.capacity) / self.charge_efficiency / self.time_interval)
+        self.max_discharge = min(self.battery_power, self.capacity / self.time_interval)
 
     def charge(self, power, spot_price=None):
         """
@@ -64,48 +70,157 @@ class Battery:
         # Charge/discharge battery, clip the value to avoid rounding error
         power = np.clip(power, self.max_charge, self.max_discharge)
         if power < 0:
-            market_dispatch = power * time_interval
+            market_dispatch = power * self.time_interval
             self.capacity -= market_dispatch * self.charge_efficiency
             revenue = spot_price * market_dispatch / self.marginal_loss_factor
         if power > 0:
-            market_dispatch = power * time_interval * self.discharge_efficiency
+            market_dispatch = power * self.time_interval * self.discharge_efficiency
             self.capacity -= market_dispatch / self.discharge_efficiency
             revenue = spot_price * market_dispatch * self.marginal_loss_factor
 
         # Recompute the thresholds
-        self.max_charge = -min(self.battery_power, (self.battery_capacity - self.capacity) / self.charge_efficiency / time_interval)
-        self.max_discharge = min(self.battery_power, self.capacity / time_interval)
+        self.max_charge = -min(self.battery_power, (self.battery_capacity - self.capacity) / self.charge_efficiency / self.time_interval)
+        self.max_discharge = min(self.battery_power, self.capacity / self.time_interval)
         return flag, revenue
 
 
-def check_submission(df, spot_prices=None, include_capacity=False, include_revenue=False):
-    initial_charge = df.loc[0, "capacity"]
-    battery = Battery(initial_charge)
-    flags = []
-    capacities = []
-    revenues = []
-    for idx, (datetime, power, capacity) in df.iterrows():
-        spot_price = 0 if spot_prices is None else spot_prices[idx]
-        if include_capacity:
-            capacities.append(battery.capacity)
-        flag, revenue = battery.charge(power, spot_price)
-        flags.append(flag)
-        revenues.append(revenue)
+def check_power(power, initial_capacity=0, spot_prices=None, battery=None):
+    """
+    Check a sequence of charging actions at once, with the same status codes and revenue as Battery.charge.
+    Energy is counted in integer fixed-point units, so the capacity is a cumulative sum that does not depend
+    on the order of floating point operations. Rows are only walked one by one from the first interval where
+    the battery would leave its capacity range, because clipping there changes every later capacity.
+    :param power: Powers to charge the battery with (positive: discharge, negative: charge)
+    :param initial_capacity: The power the battery starts with
+    :param spot_prices: Electricity prices of each interval (default: 0)
+    :param battery: Battery whose technical specification is used (default: Battery())
+    :return: Tuple of (status codes, opening capacities, revenues, closing capacity)
+    """
+    battery = Battery() if battery is None else battery
+    assert 0 <= initial_capacity <= battery.battery_capacity, "Enter valid initial capacity!"
+    power = np.asarray(power, dtype=float)
+    n = len(power)
+    interval = battery.time_interval
+
+    # power limits do not depend on the capacity
+    flags = np.where(power < -battery.battery_power - tol, StatusCodes.EXCEEDING_MAX_CHARGE_POWER,
+                     np.where(power > battery.battery_power + tol, StatusCodes.EXCEEDING_MAX_DISCHARGE_POWER,
+                              StatusCodes.NORMAL)).astype(np.int64)
+    power = np.clip(power, -battery.battery_power, battery.battery_power)
+
+    # change of capacity in fixed-point units
+    stored = np.where(power < 0, power * battery.charge_efficiency, power) * interval
+    delta = -np.rint(stored * energy_scale).astype(np.int64)
+    max_level = int(round(battery.battery_capacity * energy_scale))
+    level = np.empty(n + 1, dtype=np.int64)
+    level[0] = int(round(initial_capacity * energy_scale))
+    np.cumsum(delta, out=level[1:])
+    level[1:] += level[0]
+
+    # walk the rows from the first one leaving the capacity range
+    outside = (level[1:] > max_level) | (level[1:] < 0)
+    start = int(np.argmax(outside)) if outside.any() else n
+    if start < n:
+        charge_tol = tol * interval * battery.charge_efficiency * energy_scale
+        discharge_tol = tol * interval * energy_scale
+        clipped = []
+        c = int(level[start])
+        for i, d in enumerate(delta[start:].tolist(), start):
+            c += d
+            if c > max_level:
+                if c > max_level + charge_tol:
+                    flags[i] = StatusCodes.EXCEEDING_MAX_CHARGE_POWER
+                delta[i] -= c - max_level
+                c = max_level
+                clipped.append(i)
+            elif c < 0:
+                if c < -discharge_tol:
+                    flags[i] = StatusCodes.EXCEEDING_MAX_DISCHARGE_POWER
+                delta[i] -= c
+                c = 0
+                clipped.append(i)
+            level[i + 1] = c
+        # power actually dispatched in the clipped intervals
+        energy = -delta[clipped] / energy_scale / interval
+        power[clipped] = np.where(energy < 0, energy / battery.charge_efficiency, energy)
+
+    spot_prices = np.zeros(n) if spot_prices is None else np.asarray(spot_prices, dtype=float)
+    market_dispatch = np.where(power < 0, power, power * battery.discharge_efficiency) * interval
+    revenue = np.where(power < 0, spot_prices * market_dispatch / battery.marginal_loss_factor,
+                       spot_prices * market_dispatch * battery.marginal_loss_factor)
+
+    capacity = level / energy_scale
+    return flags, capacity[:-1], revenue, capacity[-1]
+
+
+def check_submission(df, spot_prices=None, include_capacity=False, include_revenue=False, spec=None):
+    initial_charge = df["capacity"].iloc[0]
+    battery = Battery(initial_charge, **(spec or {}))
+    flags, capacities, revenues, _ = check_power(df["power"], initial_charge, spot_prices, battery)
     results = pd.DataFrame({"datetime": df.datetime, "flag": flags})
     if include_capacity: results["capacity"] = capacities
     if include_revenue: results["revenue"] = revenues
     return results
 
 
+def check_file(submission, result, market=None, price_column="spot_price", chunksize=100000, spec=None):
+    """
+    Check a submission file chunk by chunk and append the flags (and revenue if market data is provided)
+    to the result file, so memory does not grow with the length of the submission. The battery state is
+    carried from one chunk to the next.
+    :param submission: Path to the submission file (datetime, power, capacity)
+    :param result: Path where the output file should be stored
+    :param market: Path to the market data file, aligned row by row with the submission (default: None)
+    :param price_column: Column of the market data file holding the spot price
+    :param chunksize: Number of rows read at once
+    :param spec: Overrides of the battery technical specification
+    :return: Tuple of (number of rows per status code, total revenue)
+    """
+    chunks = pd.read_csv(submission, chunksize=chunksize)
+    prices = None
+    if market is not None:
+        prices = pd.read_csv(market, usecols=[price_column], chunksize=chunksize)
+
+    battery = None
+    capacity = 0
+    counts = {code: 0 for code in StatusCodes}
+    total_revenue = 0.0
+    for k, df in enumerate(chunks):
+        if battery is None:
+            capacity = df["capacity"].iloc[0]
+            battery = Battery(capacity, **(spec or {}))
+        spot_prices = None
+        if prices is not None:
+            market_data = next(prices, None)
+            assert market_data is not None and len(market_data) == len(df), \
+                "Market data is shorter than the submission!"
+            spot_prices = market_data[price_column].values
+        flags, _, revenues, capacity = check_power(df["power"], capacity, spot_prices, battery)
+
+        results = pd.DataFrame({"datetime": df.datetime, "flag": flags})
+        if prices is not None: results["revenue"] = revenues
+        results.to_csv(result, mode="w" if k == 0 else "a", header=k == 0, index=False)
+
+        for code in StatusCodes:
+            counts[code] += int(np.sum(flags == code))
+        total_revenue += float(np.sum(revenues))
+    return counts, total_revenue
+
+
 parser = argparse.ArgumentParser(description="Check MAST30034 Battery project submission file."
                                              " In the flag column of the output file: 0 stands for normal."
                                              " 1 means the charging power is above the limit."
                                              " 2 means the discharging power is above the limit.")
-parser.add_argument("--submission", metavar="IN", type=pd.read_csv, nargs=1, required=True,
+parser.add_argument("--submission", metavar="IN", type=str, nargs=1, required=True,
                     help="Path to the submission file to be checked.")
-# Waiting for full release when this is available.
-# parser.add_argument("--market", metavar="M", type=pd.read_excel, nargs=1, required=False, default=None,
-#                     help="Path to the market data file to compute revenue.")
+parser.add_argument("--market", metavar="M", type=str, nargs=1, required=False, default=None,
+                    help="Path to the market data file to compute revenue, aligned row by row with the submission.")
+parser.add_argument("--price-column", metavar="C", type=str, default="spot_price",
+                    help="Column of the market data file holding the spot price (default: spot_price).")
+parser.add_argument("--interval", metavar="MIN", type=float, default=time_interval * 60,
+                    help="Length of a dispatch interval in minutes (default: 30, 5 for 5-minute settlement).")
+parser.add_argument("--chunksize", metavar="N", type=int, default=100000,
+                    help="Number of rows checked at once.")
 parser.add_argument("--result", metavar="OUT", type=str, nargs=1, required=True,
                     help="Path where the output file should be stored.")
 
@@ -113,9 +228,11 @@ parser.add_argument("--result", metavar="OUT", type=str, nargs=1, required=True,
 # Execute the codes only if this file is run as main.
 if __name__ == "__main__":
     args = parser.parse_args()
-    submission = args.submission[0]
-    # market_data = args.market
-    # if market_data is not None:
-    #     spot_prices = market_data["Regions VIC Trading Price ($/MWh)"]
-    spot_prices = None
-    results = check_submission(submission, spot_prices=spot_prices, include_revenue=spot_prices is not None)
+    market = None if args.market is None else args.market[0]
+    counts, revenue = check_file(args.submission[0], args.result[0], market=market,
+                                 price_column=args.price_column, chunksize=args.chunksize,
+                                 spec={"time_interval": args.interval / 60})
+    for code, count in counts.items():
+        print("%s: %d" % (code.name, count))
+    if market is not None:
+        print("Total revenue: %.2f" % revenue)
@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from battery_optimise import (battery_spec, build_battery_lp, _solve_highs, _solve_storage, _format_result,
+                              _revenue)
+from battery_flow import flow_dispatch
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+
+# asset prices and specifications shared by every solve of a worker process
+_shared = {}
+
+# pricing iterations of the grid connection before its limit is split between the assets
+GRID_ITERATIONS = 40
+
+
+def _init_worker(assets):
+    """
+    Notes: Receive the assets once per worker process instead of once per multiplier
+    """
+    _shared['assets'] = assets
+
+
+def _pool(assets, processes):
+    """
+    Notes: Worker processes holding the assets (None for a single process)
+    """
+    _shared['assets'] = assets
+    if processes == 1 or len(assets) == 1:
+        return None
+    return ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(assets,))
+
+
+def _solve_asset(args):
+    """
+    Notes: Dispatch one asset with the flow engine, released energy costs the multiplier of
+           the cycling budget per full cycle of the asset. grid is None or the price of the
+           exported and of the imported energy per MWh and the caps of the exports and the
+           imports in MW (scalars or per period, None for no cap).
+    """
+    k, multiplier, grid = args
+    spot_price, initial_capacity, spec = _shared['assets'][k]
+    max_capacity, _, _, discharge_eff, _, _ = battery_spec(spec)
+    export_price, import_price, max_export, max_import = grid or (0., 0., None, None)
+    return _solve_storage(flow_dispatch, spot_price, initial_capacity, spec,
+                          wear_cost=multiplier / max_capacity + export_price * discharge_eff,
+                          import_cost=import_price, max_import=max_import, max_export=max_export)
+
+
+def _solve_assets(pool, assets, multiplier, grids=None):
+    """
+    Notes: Dispatch every asset for a multiplier and grid prices and caps per asset (see _solve_asset)
+    """
+    jobs = [(k, multiplier, None if grids is None else grids[k]) for k in range(len(assets))]
+    if pool is None:
+        return [_solve_asset(job) for job in jobs]
+    return list(pool.map(_solve_asset, jobs))
+
+
+def _cycles(discharge_power, spec=None):
+    """
+    Notes: Number of full cycles of a dispatch (energy released from storage over the capacity)
+    """
+    max_capacity, _, _, _, _, interval = battery_spec(spec)
+    return float(np.sum(discharge_power) * interval / max_capacity)
+
+
+def _cycle_value(spot_price, spec=None):
+    """
+    Notes: Revenue of a full cycle released at the highest price of the asset
+    """
+    max_capacity, _, _, discharge_eff, mlf, _ = battery_spec(spec)
+    return max_capacity * max(float(np.max(spot_price)), 0.) * discharge_eff * mlf
+
+
+def _total_revenue(solutions, assets):
+    return sum(_revenue(price, charge, discharge, spec)
+               for (_, charge, discharge), (price, _, spec) in zip(solutions, assets))
+
+
+def _total_cycles(solutions, assets):
+    return sum(_cycles(discharge, spec) for (_, _, discharge), (_, _, spec) in zip(solutions, assets))
+
+
+def _grid_use(solutions, assets):
+    """
+    Notes: Power every asset exports (discharged power after losses) and imports (charge
+           power) through the grid connection in each period
+    """
+    export = [discharge_power * battery_spec(spec)[3] for (_, _, discharge_power), (_, _, spec) in zip(solutions, assets)]
+    return export, [charge_power for _, charge_power, _ in solutions]
+
+
+def _grid_power(solutions, assets):
+    """
+    Notes: Combined power the assets export and import through the grid connection in each period
+    """
+    export, imports = _grid_use(solutions, assets)
+    return np.maximum(sum(export), sum(imports))
+
+
+def _share(use, total, limit, count):
+    """
+    Notes: Share of the grid limit of an asset in each period: its use scaled down where the
+           combined use exceeds the limit, its use and an equal part of the slack elsewhere
+    """
+    return np.where(total > limit, use * limit / np.maximum(total, limit), use + (limit - total) / count)
+
+
+def _mix(solution_a, solution_b, weight, initial_capacity, spec=None):
+    """
+    Notes: Dispatch following weight * solution_a + (1 - weight) * solution_b. The change of
+           stored energy is mixed and netted, so an asset never charges and discharges in the
+           same period; netting only saves losses, so the revenue does not drop below the
+           mixed revenue and the cycles do not rise above the mixed cycles.
+    """
+    _, _, charge_eff, _, _, interval = battery_spec(spec)
+    stored = [(charge_power * charge_eff - discharge_power) * interval
+              for _, charge_power, discharge_power in (solution_a, solution_b)]
+    stored = weight * stored[0] + (1 - weight) * stored[1]
+    capacity = initial_capacity + np.concatenate([[0.], np.cumsum(stored)[:-1]])
+    return capacity, np.maximum(stored, 0) / interval / charge_eff, np.maximum(-stored, 0) / interval
+
+
+def _lagrangian_dispatch(assets, cycle_budget, pool=None, grids=None, first=None, rtol=1e-9, max_iter=100):
+    """
+    Notes: Dispatch the assets under a combined cycling budget by pricing the cycles. For a
+           multiplier (revenue given up per full cycle) every asset is an independent flow
+           problem; the best multiplier minimises the dual function
+               g(m) = max revenue - m * (cycles - cycle_budget),
+           which is convex and piecewise linear. The multipliers bracketing the budget are
+           refined at the intersection of their supporting lines (tens of solves), and
+           the two bracketing dispatches are mixed to spend the budget exactly.
+           grids holds the grid prices and caps of every asset (see _solve_asset) and first
+           the dispatch of a zero multiplier when it is already solved.
+
+    Returns
+    -------
+    list of (capacity, charge power, discharge power) per asset and a dictionary of the
+    multiplier, upper bound of the revenue and number of multipliers tried
+    """
+    def solve(multiplier, solutions=None):
+        if solutions is None:
+            solutions = _solve_assets(pool, assets, multiplier, grids)
+        return {'multiplier': multiplier, 'solutions': solutions, 'revenue': _total_revenue(solutions, assets),
+                'cycles': _total_cycles(solutions, assets)}
+
+    low = solve(0., first)
+    info = {'multiplier': 0., 'upper_bound': low['revenue'], 'iterations': 1}
+    if low['cycles'] <= cycle_budget:
+        return low['solutions'], info
+
+    # a multiplier above the value of a cycle at the highest price stops every discharge
+    high = solve(max(_cycle_value(price, spec) for price, _, spec in assets) + 1.)
+    upper_bound = np.inf
+    for info['iterations'] in range(3, max_iter + 3):
+        # intersection of the supporting lines of the dual function at both multipliers
+        multiplier = (low['revenue'] - high['revenue']) / (low['cycles'] - high['cycles'])
+        line = low['revenue'] - multiplier * (low['cycles'] - cycle_budget)
+        point = solve(multiplier)
+        value = point['revenue'] - multiplier * (point['cycles'] - cycle_budget)
+        upper_bound = min(upper_bound, value)
+        if point['cycles'] == cycle_budget:
+            low = high = point
+            break
+        if value <= line + rtol * max(abs(line), 1.):
+            # the multiplier is optimal, both bracketing dispatches are optimal for it
+            break
+        if point['cycles'] > cycle_budget:
+            low = point
+        else:
+            high = point
+    info.update(multiplier=multiplier, upper_bound=upper_bound)
+
+    if low is high:
+        return low['solutions'], info
+    weight = (cycle_budget - high['cycles']) / (low['cycles'] - high['cycles'])
+    return [_mix(a, b, weight, initial_capacity, spec)
+            for a, b, (_, initial_capacity, spec) in zip(low['solutions'], high['solutions'], assets)], info
+
+
+def _grid_dispatch(assets, grid_limit, cycle_budget=None, pool=None, first=None, max_iter=GRID_ITERATIONS,
+                   step=0.5, rtol=1e-9):
+    """
+    Notes: Dispatch the assets under a combined grid limit (and cycling budget) by pricing the
+           grid connection in every period. For prices of the exported and imported energy of
+           every period (and a multiplier per cycle) every asset is an independent flow problem,
+           and for any prices
+               g = max revenue - interval * sum(export price * (exports - grid_limit))
+                   - interval * sum(import price * (imports - grid_limit)) - m * (cycles - cycle_budget)
+           is an upper bound of the revenue. The prices follow the subgradient of g with steps
+           scaled by the spot price level of each period, halved whenever g stops falling.
+           The grid use averaged over the later iterations then splits the grid limit into a
+           share per asset and period (see _share), every asset is solved within its share
+           (under the cycling budget with _lagrangian_dispatch), and every asset in turn takes
+           its best dispatch within what the others leave of the limit.
+           first is the dispatch of zero prices when it is already solved.
+
+    Returns
+    -------
+    list of (capacity, charge power, discharge power) per asset and a dictionary of the
+    multiplier of the cycling budget, upper bound of the revenue and number of price iterations
+    """
+    n = len(assets[0][0])
+    interval = battery_spec(assets[0][2])[-1]
+    budget = np.inf if cycle_budget is None else cycle_budget
+    # a step of 1 moves the prices by the spot price level when the use is twice the limit
+    scale = np.mean([np.abs(price) for price, _, _ in assets], axis=0)
+    cycle_scale = np.mean([battery_spec(spec)[0] * np.mean(np.abs(price)) for price, _, spec in assets])
+
+    export_price, import_price, multiplier = np.zeros(n), np.zeros(n), 0.
+    export_use, import_use, averaged = [0.] * len(assets), [0.] * len(assets), 0
+    upper_bound, stalled = np.inf, 0
+    for iteration in range(max_iter):
+        grids = [(export_price, import_price, None, None)] * len(assets)
+        solutions = first if iteration == 0 and first is not None else _solve_assets(pool, assets, multiplier, grids)
+        export, imports = _grid_use(solutions, assets)
+        revenue, cycles = _total_revenue(solutions, assets), _total_cycles(solutions, assets)
+        excess_export, excess_import = sum(export) - grid_limit, sum(imports) - grid_limit
+        value = revenue - interval * (export_price @ excess_export + import_price @ excess_import)
+        if cycle_budget is not None:
+            value -= multiplier * (cycles - cycle_budget)
+        if value < upper_bound:
+            upper_bound, stalled = value, 0
+        else:
+            stalled += 1
+            if stalled == 2:
+                step, stalled = step / 2, 0
+        if (max(excess_export.max(), excess_import.max()) <= 1e-9 * grid_limit and cycles <= budget
+                and value <= revenue + rtol * max(abs(revenue), 1.)):
+            # a feasible dispatch meeting its upper bound is optimal
+            return solutions, {'multiplier': multiplier, 'upper_bound': float(upper_bound), 'iterations': iteration + 1}
+
+        if iteration >= max_iter // 3:
+            export_use = [total + use for total, use in zip(export_use, export)]
+            import_use = [total + use for total, use in zip(import_use, imports)]
+            averaged += 1
+        export_price = np.maximum(export_price + step * scale * excess_export / grid_limit, 0)
+        import_price = np.maximum(import_price + step * scale * excess_import / grid_limit, 0)
+        if cycle_budget is not None:
+            multiplier = max(multiplier + step * cycle_scale * (cycles - cycle_budget) / max(cycle_budget, 1.), 0.)
+
+    # split the limit by the averaged use, the shares of every period add up to the limit
+    export_use = [use / averaged for use in export_use]
+    import_use = [use / averaged for use in import_use]
+    grids = [(0., 0., _share(own_export, sum(export_use), grid_limit, len(assets)),
+              _share(own_import, sum(import_use), grid_limit, len(assets)))
+             for own_export, own_import in zip(export_use, import_use)]
+    solutions, info = _lagrangian_dispatch(assets, budget, pool, grids)
+
+    # best responses: every asset may use what the others leave of the limit
+    revenue = _total_revenue(solutions, assets)
+    for k in range(len(assets)):
+        export, imports = _grid_use(solutions, assets)
+        grid = (0., 0., grid_limit - (sum(export) - export[k]), grid_limit - (sum(imports) - imports[k]))
+        candidate = solutions[:k] + [_solve_asset((k, info['multiplier'], grid))] + solutions[k + 1:]
+        if _total_revenue(candidate, assets) > revenue and _total_cycles(candidate, assets) <= budget:
+            solutions, revenue = candidate, _total_revenue(candidate, assets)
+    return solutions, {'multiplier': info['multiplier'], 'upper_bound': float(upper_bound), 'iterations': max_iter}
+
+
+def build_portfolio_lp(assets, grid_limit=None, cycle_budget=None):
+    """
+    Notes: Block-structured model of the assets: the blocks of build_battery_lp on the
+           diagonal and the shared constraints as extra rows,
+               sum of discharge_power * discharge_eff <= grid_limit
+               sum of charge_power <= grid_limit
+               sum of discharged energy / capacity <= cycle_budget
+    ----------
+    Parameters
+    ----------
+    assets       : list of (spot price, initial capacity, specification) per asset
+    grid_limit   : combined power limit at the grid connection in MW (default=None, no limit)
+    cycle_budget : combined number of full cycles (default=None, no budget)
+
+    Returns
+    -------
+    c, A_eq, b_eq, A_ub, b_ub, bounds as build_battery_lp, the variables of the assets stacked
+    """
+    blocks = [build_battery_lp(price, initial_capacity, spec=spec) for price, initial_capacity, spec in assets]
+    n = len(assets[0][0])
+    offsets = np.cumsum([0] + [3 * n] * len(assets))
+    period = np.arange(n)
+
+    rows, cols, vals, b_ub = [], [], [], []
+    if grid_limit is not None:
+        for offset, (_, _, spec) in zip(offsets, assets):
+            discharge_eff = battery_spec(spec)[3]
+            rows += [period, period + n]
+            cols += [offset + 2 * n + period, offset + n + period]
+            vals += [np.full(n, discharge_eff), np.ones(n)]
+        b_ub.append(np.full(2 * n, grid_limit))
+    if cycle_budget is not None:
+        row = 2 * n if grid_limit is not None else 0
+        for offset, (_, _, spec) in zip(offsets, assets):
+            max_capacity, _, _, _, _, interval = battery_spec(spec)
+            rows.append(np.full(n, row))
+            cols.append(offset + 2 * n + period)
+            vals.append(np.full(n, interval / max_capacity))
+        b_ub.append([cycle_budget])
+    b_ub = np.concatenate([block[4] for block in blocks] + b_ub)
+
+    A_ub = sp.block_diag([block[3] for block in blocks], format='csr')
+    if rows:
+        shared = sp.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                               shape=(len(b_ub) - A_ub.shape[0], offsets[-1]))
+        A_ub = sp.vstack([A_ub, shared]).tocsr()
+    bounds = tuple(np.concatenate([block[5][k] for block in blocks]) for k in range(2))
+    return (np.concatenate([block[0] for block in blocks]), sp.block_diag([block[1] for block in blocks], format='csr'),
+            np.concatenate([block[2] for block in blocks]), A_ub, b_ub, bounds)
+
+
+def portfolio_optimisation(datetime, spot_prices, initial_capacity=0, specs=None, grid_limit=None,
+                           cycle_budget=None, include_revenue=True, processes=1, exact=False):
+    """
+    Notes: Optimise several batteries together, each with its own price series, under a
+           combined grid-connection limit and/or a combined cycling budget.
+           The shared constraints are the only link between the assets, so they are solved
+           block by block as far as possible:
+           1) without a cycling budget every asset is solved on its own with the flow engine
+           2) a cycling budget is priced per cycle, every asset is solved on its own for each
+              price tried (see _lagrangian_dispatch), which takes tens of flow solves
+           3) when the dispatch of 1) or 2) exceeds the grid limit, the grid connection is
+              priced in every period as well (see _grid_dispatch): tens of rounds of flow
+              solves and a repair that splits the limit between the assets. The dispatch is
+              feasible and within a fraction of a percent of the optimum on a year of the four
+              regions; the gap to the optimum is bounded by upper_bound - revenue.
+              With exact=True the whole model of build_portfolio_lp is solved at once with
+              HiGHS instead (several times slower, and far slower with a cycling budget)
+    ----------
+    Parameters
+    ----------
+    datetime         : a list of time stamp, shared by the assets
+    spot_prices      : dataframe with one price column per asset, eg. the spot_price_* columns
+                       of data/all_cv.csv, or a dictionary of asset name and prices
+    initial_capacity : initial capacity of every asset, or a dictionary per asset (default=0)
+    specs            : battery specification overrides of every asset (see battery_spec), or a
+                       dictionary of overrides per asset (default=None, the project battery)
+    grid_limit       : combined power limit at the grid connection in MW, applied to the exports
+                       and to the imports of the assets (default=None, no limit)
+    cycle_budget     : combined number of full cycles over the horizon, the energy released
+                       from storage over the capacity summed over the assets (default=None)
+    include_revenue  : add the revenue column (default=True)
+    processes        : number of worker processes the assets are solved in (default=1, None for all cores)
+    exact            : solve a binding grid limit with the monolithic LP instead of pricing it (default=False)
+
+    Returns
+    -------
+    dataframe of the battery_optimisation columns with an asset column in front, one block of
+    rows per asset. result.attrs['portfolio'] holds the method used, the revenue, an upper
+    bound of the revenue, the multiplier of the cycling budget, the cycles and the number of
+    periods where the grid limit binds.
+    """
+    spot_prices = pd.DataFrame(spot_prices)
+    names = list(spot_prices.columns)
+    if not (isinstance(specs, dict) and specs and set(specs) <= set(names)):
+        specs = {name: specs for name in names}
+    if not isinstance(initial_capacity, dict):
+        initial_capacity = {name: initial_capacity for name in names}
+    assets = [(spot_prices[name].values.astype(float), initial_capacity[name], specs.get(name)) for name in names]
+    assert len({battery_spec(spec)[-1] for _, _, spec in assets}) == 1, "The assets must share the interval length!"
+
+    def over_limit(solutions):
+        return grid_limit is not None and _grid_power(solutions, assets).max() > grid_limit * (1 + 1e-9)
+
+    pool = _pool(assets, processes)
+    try:
+        # 1) solve the assets independently
+        first = _solve_assets(pool, assets, 0.)
+        solutions, info = first, {'method': 'independent', 'multiplier': 0., 'iterations': 1}
+
+        # 2) price a cycling budget that is overspent, unless the grid limit is going to be priced anyway
+        if cycle_budget is not None and _total_cycles(first, assets) > cycle_budget and not over_limit(first):
+            solutions, info = _lagrangian_dispatch(assets, cycle_budget, pool, first=first)
+            info['method'] = 'lagrangian'
+
+        # 3) the shared grid connection binds
+        if over_limit(solutions) and exact:
+            x, duals = _solve_highs(*build_portfolio_lp(assets, grid_limit, cycle_budget))
+            solutions = [tuple(block) for block in x.reshape(len(assets), 3, len(spot_prices))]
+            info = {'method': 'monolithic lp', 'iterations': 1,
+                    'multiplier': float(duals['ub'][-1]) if cycle_budget is not None else 0.}
+        elif over_limit(solutions):
+            solutions, info = _grid_dispatch(assets, grid_limit, cycle_budget, pool,
+                                             first=first if info['method'] == 'independent' else None)
+            info['method'] = 'grid lagrangian'
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    frames = []
+    for name, (capacity, charge_power, discharge_power), (price, _, spec) in zip(names, solutions, assets):
+        frame = _format_result(datetime, price, charge_power, discharge_power, capacity,
+                               include_revenue=include_revenue, spec=spec)
+        frame.insert(0, 'asset', name)
+        frames.append(frame)
+    result = pd.concat(frames, ignore_index=True)
+
+    revenue = _total_revenue(solutions, assets)
+    info.update(revenue=revenue, upper_bound=info.get('upper_bound', revenue), cycles=_total_cycles(solutions, assets),
+                grid_binding_periods=0 if grid_limit is None else
+                int(np.sum(_grid_power(solutions, assets) >= grid_limit * (1 - 1e-6))))
+    result.attrs['portfolio'] = info
+    return result
+
+
+parser = argparse.ArgumentParser(description="Optimise the batteries of several regions together under a combined"
+                                             " grid-connection limit and/or cycling budget.")
+parser.add_argument("--data", metavar="CSV", type=str, default=os.path.join(DATA_DIR, 'all_cv.csv'),
+                    help="Csv file with a time column and a spot_price_<region> column per region.")
+parser.add_argument("--regions", metavar="R", type=str, nargs="+", default=None,
+                    help="Regions of the assets (default: every spot_price_ column).")
+parser.add_argument("--grid-limit", metavar="MW", type=float, default=None,
+                    help="Combined power limit at the grid connection in MW.")
+parser.add_argument("--cycle-budget", metavar="N", type=float, default=None,
+                    help="Combined number of full cycles over the horizon.")
+parser.add_argument("--processes", metavar="P", type=int, default=1,
+                    help="Number of worker processes the assets are solved in (default: 1).")
+parser.add_argument("--exact", action="store_true",
+                    help="Solve a binding grid limit with the monolithic LP instead of pricing it.")
+parser.add_argument("--result", metavar="OUT", type=str, default=None,
+                    help="Path where the dispatch of the assets should be stored (default: not stored).")
+
+
+# Execute the codes only if this file is run as main.
+if __name__ == "__main__":
+    args = parser.parse_args()
+    data = pd.read_csv(args.data, parse_dates=['time'])
+    regions = args.regions or [column[len('spot_price_'):] for column in data.columns
+                               if column.startswith('spot_price_')]
+    prices = pd.DataFrame({region: data['spot_price_' + region] for region in regions})
+    result = portfolio_optimisation(data.time, prices, grid_limit=args.grid_limit, cycle_budget=args.cycle_budget,
+                                    processes=args.processes, exact=args.exact)
+    if args.result is not None:
+        result.to_csv(args.result, index=False)
+    print(result.groupby('asset').revenue.sum())
+    print(result.attrs['portfolio'])
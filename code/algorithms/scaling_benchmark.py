@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+import os
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from battery_optimise import battery_optimisation, periods_per_day
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+HORIZONS = {'1 day': 1, '1 week': 7, '1 month': 30, '1 year': 365, 'full': None}
+
+
+def interval_prices(spot_price, interval):
+    """
+    Notes: Spread half-hour prices over shorter intervals, every interval of a half-hour
+           settles at its price (eg. 6 intervals of 5 minutes)
+    """
+    repeat = 0.5 / interval
+    assert abs(repeat - round(repeat)) < 1e-9, "A half-hour must hold a whole number of intervals!"
+    return np.repeat(np.asarray(spot_price, dtype=float), int(round(repeat)))
+
+
+def _measure(spot_price, solver, spec, memory):
+    """
+    Notes: Solve time in seconds and peak traced memory in MB of one solve
+    """
+    datetime = np.arange(len(spot_price))
+    start = time.perf_counter()
+    revenue = battery_optimisation(datetime, spot_price, solver=solver, spec=spec).revenue.sum()
+    seconds = time.perf_counter() - start
+
+    peak = np.nan
+    if memory:
+        # traced separately, tracing slows the pure python engines down
+        tracemalloc.start()
+        battery_optimisation(datetime, spot_price, solver=solver, spec=spec)
+        peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+    return seconds, peak, revenue
+
+
+def scaling_benchmark(spot_price, interval=5 / 60, solvers=('flow', 'dp'), horizons=HORIZONS, memory=True):
+    """
+    Notes: Solve time and peak memory of the dispatch engines as the number of periods grows
+    ----------
+    Parameters
+    ----------
+    spot_price : half-hour spot prices, spread over the intervals with interval_prices
+    interval   : interval length in hours (default=5 / 60)
+    solvers    : solvers passed to battery_optimisation (default=('flow', 'dp'))
+    horizons   : dictionary of horizon name and number of days (None for all prices)
+    memory     : also trace the peak memory of every solve (default=True)
+
+    Returns
+    -------
+    dataframe with solver, horizon, periods, seconds, peak memory (MB), revenue and the
+    growth exponent of the solve time (slope of log seconds against log periods)
+    """
+    spec = {'time_interval': interval}
+    prices = interval_prices(spot_price, interval)
+    day = periods_per_day(spec)
+
+    rows = []
+    for solver in solvers:
+        for name, days in horizons.items():
+            price = prices if days is None else prices[:days * day]
+            seconds, peak, revenue = _measure(price, solver, spec, memory)
+            rows.append({'solver': solver, 'horizon': name, 'periods': len(price), 'seconds': seconds,
+                         'peak_mb': peak, 'revenue': revenue})
+            print('%-6s %-8s %8d periods %9.3f s %9.1f MB' % (solver, name, len(price), seconds, peak))
+
+    result = pd.DataFrame(rows)
+    for solver, group in result.groupby('solver'):
+        slope = np.polyfit(np.log(group.periods), np.log(group.seconds), 1)[0] if len(group) > 1 else np.nan
+        result.loc[group.index, 'growth'] = slope
+    return result
+
+
+parser = argparse.ArgumentParser(description="Measure how the solve time and memory of the dispatch engines grow"
+                                             " with the number of periods.")
+parser.add_argument("--region", metavar="R", type=str, default="vic",
+                    help="Region whose prices are used (default: vic).")
+parser.add_argument("--interval", metavar="MIN", type=float, default=5,
+                    help="Length of a dispatch interval in minutes (default: 5).")
+parser.add_argument("--solvers", metavar="S", type=str, nargs="+", default=["flow", "dp"],
+                    help="Solvers passed to battery_optimisation (default: flow dp).")
+parser.add_argument("--no-memory", action="store_true",
+                    help="Do not trace the peak memory (halves the run time).")
+parser.add_argument("--data", metavar="DIR", type=str, default=DATA_DIR,
+                    help="Directory of the region csv files.")
+parser.add_argument("--result", metavar="OUT", type=str, default=None,
+                    help="Path where the benchmark table should be stored (default: not stored).")
+
+
+# Execute the codes only if this file is run as main.
+if __name__ == "__main__":
+    args = parser.parse_args()
+    data = pd.read_csv(os.path.join(args.data, args.region + '.csv'))
+    table = scaling_benchmark(data.spot_price, args.interval / 60, args.solvers, memory=not args.no_memory)
+    if args.result is not None:
+        table.to_csv(args.result, index=False)
+    print(table.groupby('solver').growth.first())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+import os
+import argparse
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from battery_optimise import battery_spec, _dispatch
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+
+# price data shared by every scenario of a worker process
+_shared = {}
+
+
+def scenario_grid(grid):
+    """
+    Notes: Expand a parameter grid into battery specifications, one per combination.
+           'efficiency' is a shorthand for equal charge and discharge efficiencies.
+    ----------
+    Parameters
+    ----------
+    grid : dictionary of lists keyed by check.Battery attribute names,
+           eg. {'battery_capacity': [580, 1160], 'battery_power': [150, 300]}
+
+    Returns
+    -------
+    list of specification dictionaries
+    """
+    names = list(grid)
+    specs = []
+    for values in product(*(grid[name] for name in names)):
+        spec = dict(zip(names, values))
+        if 'efficiency' in spec:
+            efficiency = spec.pop('efficiency')
+            spec['charge_efficiency'] = spec['discharge_efficiency'] = efficiency
+        battery_spec(spec) # fail early on unknown names
+        specs.append(spec)
+    return specs
+
+
+def _init_worker(spot_price, year):
+    """
+    Notes: Receive the price data once per worker process instead of once per scenario
+    """
+    _shared['spot_price'] = spot_price
+    _shared['year'] = year
+
+
+def _run_scenario(args):
+    """
+    Notes: Dispatch one battery specification over the shared prices and sum the revenue per year
+    """
+    spec, initial_capacity, solver = args
+    spot_price, year = _shared['spot_price'], _shared['year']
+    _, _, _, discharge_eff, mlf, interval = battery_spec(spec)
+    _, charge_power, discharge_power = _dispatch(spot_price, initial_capacity, solver=solver, spec=spec)
+    revenue = spot_price * interval * (discharge_power * discharge_eff * mlf - charge_power / mlf)
+    return np.bincount(year, weights=revenue, minlength=year.max() + 1)
+
+
+def scenario_sweep(datetime, spot_price, grid, initial_capacity=0, solver='flow', processes=None):
+    """
+    Notes: Revenue of every battery specification of a parameter grid. The prices are
+           sent to each worker process once and the scenarios are solved in parallel.
+    ----------
+    Parameters
+    ----------
+    datetime         : time stamps of the prices
+    spot_price       : spot prices
+    grid             : parameter grid, see scenario_grid
+    initial_capacity : opening capacity of the first period (default=0)
+    solver           : solver passed to battery_optimisation (default='flow')
+    processes        : number of worker processes (default=None, one per cpu)
+
+    Returns
+    -------
+    dataframe with scenario, the grid parameters, year and revenue
+    """
+    specs = scenario_grid(grid)
+    years, year = np.unique(pd.DatetimeIndex(datetime).year, return_inverse=True)
+    spot_price = np.asarray(spot_price, dtype=float)
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(spot_price, year)) as pool:
+        revenues = list(pool.map(_run_scenario, [(spec, initial_capacity, solver) for spec in specs]))
+
+    rows = [dict(scenario=i, **spec, year=y, revenue=r)
+            for i, (spec, revenue) in enumerate(zip(specs, revenues))
+            for y, r in zip(years, revenue)]
+    return pd.DataFrame(rows)
+
+
+parser = argparse.ArgumentParser(description="Sweep battery specifications over one region and write the"
+                                             " revenue of every scenario and year.")
+parser.add_argument("--region", metavar="R", type=str, default="vic",
+                    help="Region whose prices are used (default: vic).")
+parser.add_argument("--capacity", metavar="MWh", type=float, nargs="+", default=None,
+                    help="Battery capacities to sweep.")
+parser.add_argument("--power", metavar="MW", type=float, nargs="+", default=None,
+                    help="Battery raw powers to sweep.")
+parser.add_argument("--efficiency", metavar="E", type=float, nargs="+", default=None,
+                    help="Charge and discharge efficiencies to sweep.")
+parser.add_argument("--solver", metavar="S", type=str, default="flow",
+                    help="Solver passed to battery_optimisation (eg. 'flow', 'dp', 'glpk').")
+parser.add_argument("--workers", metavar="N", type=int, default=None,
+                    help="Number of worker processes (default: one per cpu).")
+parser.add_argument("--data", metavar="DIR", type=str, default=DATA_DIR,
+                    help="Directory of the region csv files.")
+parser.add_argument("--result", metavar="OUT", type=str, required=True,
+                    help="Path where the revenue table should be stored.")
+
+
+# Execute the codes only if this file is run as main.
+if __name__ == "__main__":
+    args = parser.parse_args()
+    data = pd.read_csv(os.path.join(args.data, args.region + '.csv'), parse_dates=['time'])
+    grid = {name: values for name, values in [('battery_capacity', args.capacity),
+                                              ('battery_power', args.power),
+                                              ('efficiency', args.efficiency)] if values}
+    table = scenario_sweep(data.time, data.spot_price, grid, solver=args.solver, processes=args.workers)
+    table.to_csv(args.result, index=False)
+    print(table.groupby('scenario').revenue.sum())
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import warnings
+import subprocess
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(CODE_DIR, '..')
+sys.path[:0] = [os.path.join(CODE_DIR, 'algorithms'), os.path.join(CODE_DIR, 'modelling')]
+sys.path.append(os.path.join(ROOT_DIR, 'deprecated'))
+
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+RESULT = os.path.join(ROOT_DIR, 'results', 'benchmark.json')
+BASELINE = os.path.join(ROOT_DIR, 'results', 'benchmark_baseline.json')
+
+# horizons of battery_optimisation in half-hour periods (None for the whole data set)
+HORIZONS = {'1 day': 48, '1 month': 48 * 30, '1 year': 48 * 365, 'full': None}
+PLOT_PERIODS = 48 * 7
+# a benchmark regresses when its fastest call slows down by more than this fraction of the baseline
+# and by more than NOISE seconds
+TOLERANCE = 0.25
+NOISE = 0.005
+
+
+def benchmarks(region='vic', solver='flow', data_dir=DATA_DIR):
+    """
+    Notes: Entry points to benchmark on the bundled data, set up ahead of the timing
+    ----------
+    Parameters
+    ----------
+    region   : region whose market data is used (default='vic')
+    solver   : solver passed to battery_optimisation (default='flow')
+    data_dir : directory of the region csv files
+
+    Returns
+    -------
+    dictionary of benchmark name and (function without arguments, number of periods)
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from battery_optimise import battery_optimisation
+    from check import check_submission
+    from algo_utils import plot_actions
+    from tsa_utils import add_fourier_terms
+    from algo_sample import calc_forecast
+    from algo_tom import calc_forecast_tom_2, filter_forecast, optimize_dispatch
+
+    data = pd.read_csv(os.path.join(data_dir, region + '.csv'), parse_dates=['time'])
+    time_stamps, spot_price = data.time, data.spot_price
+
+    cases = {}
+    for name, periods in HORIZONS.items():
+        periods = periods or len(data)
+        cases['battery_optimisation[%s, %s]' % (solver, name)] = (
+            lambda periods=periods: battery_optimisation(time_stamps[:periods], spot_price[:periods], solver=solver),
+            periods)
+
+    result = battery_optimisation(time_stamps, spot_price, solver=solver)
+    submission = pd.DataFrame({'datetime': result.datetime, 'power': result.power,
+                               'capacity': result.opening_capacity})
+    cases['check_submission'] = (lambda: check_submission(submission, spot_price, include_capacity=True,
+                                                          include_revenue=True), len(data))
+
+    def plot():
+        plot_actions(spot_price, result.power.values, result.opening_capacity, start=-PLOT_PERIODS - 1)
+        plt.close('all')
+    cases['plot_actions'] = (plot, PLOT_PERIODS)
+
+    cases['add_fourier_terms'] = (lambda: add_fourier_terms(time_stamps, 3, 3, 3), len(data))
+
+    forecast = calc_forecast_tom_2(spot_price)
+    filtered = filter_forecast(spot_price, forecast)
+    cases['calc_forecast'] = (lambda: calc_forecast(spot_price), len(data))
+    cases['filter_forecast'] = (lambda: filter_forecast(spot_price, forecast), len(data))
+    cases['optimize_dispatch'] = (lambda: optimize_dispatch(spot_price, filtered), len(data))
+    return cases
+
+
+def measure(function, repeat=3, memory=True):
+    """
+    Notes: Wall time of repeated calls and peak traced memory of one more call
+    ----------
+    Parameters
+    ----------
+    function : function without arguments
+    repeat   : number of timed calls (default=3)
+    memory   : also trace the peak memory, in a separate call since tracing slows python code down
+
+    Returns
+    -------
+    dictionary of seconds per call, median and minimum seconds and peak memory in MB
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+    return {'seconds': seconds, 'median': float(np.median(seconds)), 'min': float(min(seconds)), 'peak_mb': peak}
+
+
+def _environment():
+    """
+    Notes: Machine and code version the timings belong to
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=CODE_DIR, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'timestamp': pd.Timestamp.now().isoformat(timespec='seconds'), 'commit': commit,
+            'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.machine(),
+            'numpy': np.__version__, 'pandas': pd.__version__}
+
+
+def run_benchmarks(region='vic', solver='flow', repeat=5, memory=True, only=None, data_dir=DATA_DIR):
+    """
+    Notes: Time and memory-profile every benchmark
+    ----------
+    Parameters
+    ----------
+    region   : region whose market data is used (default='vic')
+    solver   : solver passed to battery_optimisation (default='flow')
+    repeat   : number of timed calls per benchmark (default=5)
+    memory   : also trace the peak memory (default=True)
+    only     : list of substrings, only run the benchmarks whose name contains one (default=None, all)
+    data_dir : directory of the region csv files
+
+    Returns
+    -------
+    dictionary with the environment and the measurements per benchmark, json serialisable
+    """
+    with warnings.catch_warnings():
+        # the deprecated code relies on chained assignment
+        warnings.simplefilter('ignore')
+        cases = benchmarks(region, solver, data_dir)
+        results = {}
+        for name, (function, periods) in cases.items():
+            if only and not any(part in name for part in only):
+                continue
+            results[name] = dict(measure(function, repeat, memory), periods=periods)
+            print('%-40s %9.4f s %9s MB' % (name, results[name]['median'],
+                                             '-' if results[name]['peak_mb'] is None
+                                             else '%.1f' % results[name]['peak_mb']))
+    return {'environment': _environment(), 'region': region, 'solver': solver, 'only': only, 'results': results}
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    """
+    Notes: Compare the fastest call and peak memory of a report with a saved baseline,
+           the fastest of the repeated calls is the least disturbed by other processes
+    ----------
+    Parameters
+    ----------
+    report    : report of run_benchmarks
+    baseline  : report of run_benchmarks saved earlier (on the same machine)
+    tolerance : relative slow-down counted as a regression (default=0.25)
+
+    Returns
+    -------
+    dataframe with benchmark, baseline and current seconds, time ratio, memory ratio
+    and status ('regression', 'improvement', 'ok', 'new' or 'missing')
+    """
+    current, previous = report['results'], baseline['results']
+    only = report.get('only')
+    rows = []
+    for name in list(current) + [name for name in previous if name not in current and
+                                 (not only or any(part in name for part in only))]:
+        now, before = current.get(name), previous.get(name)
+        row = {'benchmark': name, 'baseline_s': before and before['min'], 'current_s': now and now['min'],
+               'time_ratio': np.nan, 'memory_ratio': np.nan}
+        if now is None or before is None:
+            row['status'] = 'missing' if now is None else 'new'
+        else:
+            row['time_ratio'] = now['min'] / before['min'] if before['min'] else np.nan
+            if now['peak_mb'] and before['peak_mb']:
+                row['memory_ratio'] = now['peak_mb'] / before['peak_mb']
+            row['status'] = 'ok'
+            if abs(now['min'] - before['min']) > NOISE:
+                if row['time_ratio'] > 1 + tolerance:
+                    row['status'] = 'regression'
+                elif row['time_ratio'] < 1 / (1 + tolerance):
+                    row['status'] = 'improvement'
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+parser = argparse.ArgumentParser(description="Time and memory-profile the optimiser, checker, plotting and signal"
+                                             " generators on the bundled data, and compare with a saved baseline.")
+parser.add_argument("--region", metavar="R", type=str, default="vic",
+                    help="Region whose market data is used (default: vic).")
+parser.add_argument("--solver", metavar="S", type=str, default="flow",
+                    help="Solver passed to battery_optimisation (default: flow).")
+parser.add_argument("--repeat", metavar="N", type=int, default=5,
+                    help="Number of timed calls per benchmark (default: 5).")
+parser.add_argument("--only", metavar="NAME", type=str, nargs="+", default=None,
+                    help="Only run the benchmarks whose name contains one of these, eg. --only check plot.")
+parser.add_argument("--no-memory", action="store_true",
+                    help="Do not trace the peak memory.")
+parser.add_argument("--result", metavar="OUT", type=str, default=RESULT,
+                    help="Path where the json report should be stored.")
+parser.add_argument("--baseline", metavar="B", type=str, default=BASELINE,
+                    help="Json report the timings are compared with, when it exists.")
+parser.add_argument("--save-baseline", action="store_true",
+                    help="Store the report as the new baseline.")
+parser.add_argument("--tolerance", metavar="T", type=float, default=TOLERANCE,
+                    help="Relative slow-down counted as a regression (default: 0.25).")
+
+
+# Execute the codes only if this file is run as main.
+if __name__ == "__main__":
+    args = parser.parse_args()
+    report = run_benchmarks(args.region, args.solver, args.repeat, not args.no_memory, args.only)
+    for path in [args.result] + ([args.baseline] if args.save_baseline else []):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            table = compare(report, json.load(f), args.tolerance)
+        print(table.to_string(index=False))
+        # a non-zero exit status lets scripts stop on regressions
+        sys.exit(int((table.status == 'regression').any()))
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(CODE_DIR, 'algorithms'), os.path.join(CODE_DIR, 'modelling')]
+
+DATA_DIR = os.path.join(CODE_DIR, '..', 'data')
+SUBMISSION = os.path.join(CODE_DIR, '..', 'results', 'daily_submission.csv')
+
+# seconds each stage may take once the models of the refit period are registered
+DEFAULT_BUDGETS = {'load': 1, 'demand': 3, 'price': 2, 'dispatch': 1, 'check': 1}
+
+# imported once before the stage processes are forked instead of once per stage
+PRELOAD = ['battery_optimise', 'check', 'feature_store', 'model_registry', 'tsa_utils', 'sklearn.ensemble',
+           'statsmodels.tsa.statespace.sarimax']
+
+# demand model of random_forest_with_unknow.ipynb (demand known up to the day before only),
+# the lags are set per interval length in _demand_config
+DEMAND_CONFIG = {'inter_gen': [], 'solar': False}
+DEMAND_LAG_DAYS = 3
+DEMAND_PARAMS = {'n_estimators': 100, 'random_state': 1}
+PRICE_ORDER = (1, 1, 1)
+
+
+def _train_end(day, refit_days):
+    """
+    Notes: Start of the refit period of a day, models are trained on the data before it
+    """
+    return day - pd.Timedelta(days=(day - pd.Timestamp('2018-01-01')).days % refit_days)
+
+
+def _fit_rfr(X, y, **params):
+    from sklearn.ensemble import RandomForestRegressor
+    return RandomForestRegressor(**params).fit(X, y)
+
+
+def _fit_sarimax(y, X, order=PRICE_ORDER):
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+    return SARIMAX(endog=y, exog=X, order=order).fit(disp=False)
+
+
+def _day_intervals(spec=None):
+    """
+    Notes: Number and length of the dispatch intervals of one day
+    """
+    from battery_optimise import battery_spec, periods_per_day
+    return periods_per_day(spec), pd.Timedelta(hours=battery_spec(spec)[-1])
+
+
+def _demand_config(region, spec=None):
+    """
+    Notes: Feature configuration of the demand model, the PACF lags are searched from one day
+           up to DEMAND_LAG_DAYS days counted in intervals of the battery spec
+    """
+    periods = _day_intervals(spec)[0]
+    return dict(DEMAND_CONFIG, region=region,
+                lags={'nlags': DEMAND_LAG_DAYS * periods, 'min_lag': periods, 'top': 5})
+
+
+def _preload():
+    """
+    Notes: Import the modules of the stages in this process, so the stage processes forked
+           from it start with them (does nothing where processes are spawned)
+    """
+    if multiprocessing.get_start_method() == 'fork':
+        import importlib
+        for name in PRELOAD:
+            importlib.import_module(name)
+
+
+def stage_load(region, day, data_dir=DATA_DIR, spec=None):
+    """
+    Notes: Market rows before the target day, the time stamps of the day and the time stamps
+           to forecast (from the newest row up to the end of the day)
+    """
+    data = pd.read_csv(os.path.join(data_dir, region + '.csv'), usecols=['time', 'spot_price', 'demand'])
+    time_stamps = pd.to_datetime(data.time)
+    history = data[(time_stamps < day).values]
+    periods, interval = _day_intervals(spec)
+    day_time = pd.date_range(day, periods=periods, freq=interval)
+    ahead_time = pd.date_range(pd.Timestamp(history.time.iloc[-1]) + interval, day_time[-1], freq=interval)
+    return {'time': pd.to_datetime(history.time).values, 'spot_price': history.spot_price.values,
+            'demand': history.demand.values, 'day_time': day_time.values, 'ahead_time': ahead_time.values}
+
+
+def stage_demand(region, day, history, refit_days, registry_dir, data_dir=DATA_DIR, spec=None):
+    """
+    Notes: Forecast the demand of the periods ahead of the history with the random forest.
+           Their features are built from the time stamps and the demand history (lag
+           features start at one day), so the day needs no rows in the data yet.
+    """
+    from feature_store import load_features, build_ahead_features
+    from model_registry import ModelRegistry
+
+    config = _demand_config(region, spec)
+    features = load_features(config, data_dir)
+    target = config.get('target', 'demand') + '_' + region
+    nlags = features.columns.str.extract(r'n_lag(\d+)')[0].dropna().astype(int).max()
+    train = features[features.index < _train_end(day, refit_days)][nlags:]
+    ahead = build_ahead_features(config, history['ahead_time'], history['time'], history['demand'], features.columns)
+
+    registry = ModelRegistry(registry_dir)
+    model = registry.fit(region + '_demand_rfr', _fit_rfr, (train.drop(columns=target), train[target]),
+                         config=config, params=DEMAND_PARAMS)
+    return model.predict(ahead.drop(columns=target))
+
+
+def stage_price(region, day, history, predicted_demand, refit_days, registry_dir):
+    """
+    Notes: Forecast the spot price of the periods ahead of the history with SARIMAX on demand
+           and return those of the day. The model is registered per refit period and extended
+           with the rows since then instead of refitted.
+    """
+    from model_registry import ModelRegistry
+    from tsa_utils import expanding_iqr_bounds
+
+    price = history['spot_price'].astype(float)
+    demand = history['demand'].astype(float)[:, None]
+    train_end = int(np.searchsorted(history['time'], np.datetime64(_train_end(day, refit_days))))
+
+    # we set lower and upper boundary so outliers won't affect our model too much
+    (lower, upper), (day_lower, day_upper) = expanding_iqr_bounds(price, [train_end, len(price)])
+    registry = ModelRegistry(registry_dir)
+    results = registry.fit(region + '_spot_price_sarimax', _fit_sarimax,
+                           (np.clip(price[:train_end], lower, upper), demand[:train_end]),
+                           params={'order': PRICE_ORDER})
+    if train_end < len(price):
+        results = results.extend(np.clip(price[train_end:], day_lower, day_upper), exog=demand[train_end:])
+    forecast = results.forecast(steps=len(predicted_demand), exog=np.asarray(predicted_demand)[:, None])
+    return np.asarray(forecast)[-len(history['day_time']):]
+
+
+def stage_dispatch(day_time, predicted_price, initial_capacity, solver, spec=None):
+    """
+    Notes: Day-ahead dispatch of the predicted prices from the carried-over capacity
+    """
+    from battery_optimise import battery_optimisation
+    result = battery_optimisation(pd.Series(day_time), pd.Series(predicted_price),
+                                  initial_capacity=initial_capacity, solver=solver, spec=spec)
+    return result.power.values, result.opening_capacity.values
+
+
+def stage_check(power, initial_capacity, spec=None):
+    """
+    Notes: Check the dispatch with the logic of check.py, return the closing capacity
+    """
+    from check import Battery, check_power, StatusCodes
+    flags, _, _, closing_capacity = check_power(power, initial_capacity, battery=Battery(**(spec or {})))
+    assert (flags == StatusCodes.NORMAL).all(), "Dispatch exceeds the battery limits: %s" % flags
+    return closing_capacity
+
+
+def run_stage(name, function, args, budget=None):
+    """
+    Notes: Run a stage in its own process, terminating it once it exceeds its budget
+    """
+    start = time.time()
+    pool = multiprocessing.Pool(1)
+    try:
+        result = pool.apply_async(function, args).get(timeout=budget)
+    except multiprocessing.TimeoutError:
+        raise TimeoutError("Stage '%s' exceeded its budget of %s seconds" % (name, budget))
+    finally:
+        pool.terminate()
+    print('%-8s %6.2f s' % (name, time.time() - start))
+    return result
+
+
+def opening_capacity(submission, spec=None):
+    """
+    Notes: Closing capacity of the last row of the submission (0 for a new submission)
+    """
+    if not os.path.exists(submission):
+        return None, 0
+    last = pd.read_csv(submission).iloc[-1]
+    from check import Battery, check_power
+    return pd.Timestamp(last.datetime), check_power([last.power], last.capacity, battery=Battery(**(spec or {})))[3]
+
+
+def run_day(day, region='vic', submission=SUBMISSION, solver='flow', refit_days=7, budgets=None,
+            prepare=False, registry_dir=None, data_dir=DATA_DIR, spec=None):
+    """
+    Notes: Forecast demand and price of one day, solve the day-ahead dispatch from the carried-over
+           capacity, check it and append it to the submission. Every stage runs in its own process
+           within its latency budget. The day needs no rows in the data, the periods from the
+           newest row up to the end of the day are forecast.
+    ----------
+    Parameters
+    ----------
+    day          : target day
+    region       : region to dispatch (default='vic')
+    submission   : submission file the day is appended to (datetime, power, capacity, spot_price_prediction)
+    solver       : solver passed to battery_optimisation (default='flow')
+    refit_days   : number of days the registered models are reused before they are refitted (default=7)
+    budgets      : seconds per stage (default=DEFAULT_BUDGETS, None for a stage means no limit)
+    prepare      : only train and register the models of the day without budgets (default=False)
+    registry_dir : directory of the model registry (default=None, model_registry.REGISTRY_DIR)
+    data_dir     : directory of the region csv files
+    spec         : battery specification overrides, eg. {'time_interval': 5 / 60} for 5-minute data
+
+    Returns
+    -------
+    dataframe of the rows appended to the submission (None when preparing)
+    """
+    from model_registry import REGISTRY_DIR
+    registry_dir = registry_dir or REGISTRY_DIR
+    budgets = dict(DEFAULT_BUDGETS, **(budgets or {}))
+    if prepare:
+        budgets.update(demand=None, price=None)
+    day = pd.Timestamp(day).normalize()
+
+    last_time, initial_capacity = opening_capacity(submission, spec)
+    assert prepare or last_time is None or last_time < day, "%s is already in the submission!" % day.date()
+
+    _preload()
+    history = run_stage('load', stage_load, (region, day, data_dir, spec), budgets['load'])
+    demand = run_stage('demand', stage_demand, (region, day, history, refit_days, registry_dir, data_dir, spec),
+                       budgets['demand'])
+    price = run_stage('price', stage_price, (region, day, history, demand, refit_days, registry_dir),
+                      budgets['price'])
+    if prepare:
+        return None
+    power, capacity = run_stage('dispatch', stage_dispatch,
+                                (history['day_time'], price, initial_capacity, solver, spec), budgets['dispatch'])
+    run_stage('check', stage_check, (power, initial_capacity, spec), budgets['check'])
+
+    rows = pd.DataFrame({'datetime': pd.DatetimeIndex(history['day_time']).strftime('%Y-%m-%d %H:%M:%S'),
+                         'power': power, 'capacity': capacity, 'spot_price_prediction': price})
+    rows.to_csv(submission, mode='a', header=last_time is None, index=False)
+    return rows
+
+
+parser = argparse.ArgumentParser(description="Forecast demand and price of a day, solve its dispatch and append it"
+                                             " to the submission file.")
+parser.add_argument("--day", metavar="D", type=str, required=True,
+                    help="Target day, eg. 2021-07-01.")
+parser.add_argument("--region", metavar="R", type=str, default="vic",
+                    help="Region to dispatch (default: vic).")
+parser.add_argument("--submission", metavar="OUT", type=str, default=SUBMISSION,
+                    help="Submission file the day is appended to.")
+parser.add_argument("--solver", metavar="S", type=str, default="flow",
+                    help="Solver passed to battery_optimisation (default: flow).")
+parser.add_argument("--refit-days", metavar="N", type=int, default=7,
+                    help="Number of days the registered models are reused before they are refitted (default: 7).")
+parser.add_argument("--budget", metavar=("STAGE", "SECONDS"), nargs=2, action="append", default=[],
+                    help="Latency budget of a stage, eg. --budget price 20. Can be repeated.")
+parser.add_argument("--interval", metavar="MIN", type=float, default=30,
+                    help="Length of a dispatch interval of the data in minutes (default: 30).")
+parser.add_argument("--prepare", action="store_true",
+                    help="Train the models of the refit period without budgets (eg. ahead of the daily run).")
+
+
+# Execute the codes only if this file is run as main.
+if __name__ == "__main__":
+    args = parser.parse_args()
+    budgets = {stage: float(seconds) for stage, seconds in args.budget}
+    print(run_day(args.day, args.region, args.submission, args.solver, args.refit_days, budgets, args.prepare,
+                  spec={'time_interval': args.interval / 60}))
@@ -0,0 +1,214 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from tsa_utils import add_fourier_terms, select_lags
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+CACHE_DIR = os.path.join(DATA_DIR, 'features')
+SOLAR_FILE = os.path.join('external', 'solar.csv')
+
+# bump when the features below change, so cached matrices are rebuilt
+FEATURE_VERSION = 1
+
+DEFAULT_CONFIG = {
+    'region': 'vic',
+    'target': 'demand',
+    'inter_gen': ['nsw', 'sa', 'tas', 'vic'],
+    'calendar': True,
+    'solar': True,
+    'fourier': [3, 3, 3],  # year_k, week_k, day_k
+    'lags': {'nlags': 144, 'min_lag': 48, 'top': 5},  # top PACF lags from min_lag up to nlags, in rows
+}
+
+
+def _input_files(config):
+    """
+    Notes: Data files a feature configuration is built from
+    """
+    regions = sorted(set(config['inter_gen']) | {config['region']})
+    files = [region + '.csv' for region in regions]
+    if config['solar']:
+        files.append(SOLAR_FILE)
+    return files
+
+
+def _calendar_columns(time):
+    """
+    Notes: Calendar columns of a series of time stamps
+    """
+    month = time.dt.month.values
+    return {'month': month, 'day': time.dt.day.values, 'day_of_year': time.dt.dayofyear.values,
+            'year': time.dt.year.values, 'weekday': time.dt.weekday.values,
+            'week': time.dt.isocalendar().week.values, 'hour': time.dt.hour.values,
+            'season': month % 12 // 3 + 1}  # summer 1, autumn 2, winter 3, spring 4
+
+
+def feature_key(config, data_dir=DATA_DIR):
+    """
+    Notes: Hash of the input data and the feature configuration
+    """
+    digest = hashlib.sha1(json.dumps([FEATURE_VERSION, config], sort_keys=True).encode())
+    for name in _input_files(config):
+        with open(os.path.join(data_dir, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def build_features(config=None, data_dir=DATA_DIR):
+    """
+    Notes: Build the feature matrix of the random forest notebooks: interconnector generation,
+           the target, period, calendar columns, solar exposure, Fourier terms and PACF lags
+    ----------
+    Parameters
+    ----------
+    config   : feature configuration, see DEFAULT_CONFIG (default=None, DEFAULT_CONFIG)
+    data_dir : directory of the region csv files
+
+    Returns
+    -------
+    time stamps, float32 feature matrix and list of column names
+    """
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    region, target = config['region'], config['target']
+    data = pd.read_csv(os.path.join(data_dir, region + '.csv'))
+    time = pd.to_datetime(data.time)
+
+    columns = {}
+    for other in config['inter_gen']:
+        other_data = data if other == region else pd.read_csv(os.path.join(data_dir, other + '.csv'),
+                                                              usecols=['time', 'inter_gen'])
+        assert (other_data.time.values == data.time.values).all(), "Regions must share the same time stamps!"
+        columns['inter_gen_' + other] = other_data.inter_gen.values
+    columns[target + '_' + region] = data[target].values
+    columns['period'] = data.period.values
+
+    if config['calendar']:
+        columns.update(_calendar_columns(time))
+
+    if config['solar']:
+        solar = pd.read_csv(os.path.join(data_dir, SOLAR_FILE))
+        exposure = pd.Series(solar['Daily global solar exposure (MJ/m*m)'].values,
+                             index=pd.to_datetime(dict(year=solar.Year, month=solar.Month, day=solar.Day)))
+        columns['solar_exposure'] = exposure.reindex(time.dt.normalize()).values
+
+    if config['fourier']:
+        fourier_terms = add_fourier_terms(time, *config['fourier'])
+        for name in fourier_terms.columns.drop('datetime'):
+            columns[name] = fourier_terms[name].values
+
+    if config['lags']:
+        series = data[target]
+        for nlag in select_lags(series, **config['lags'])[target]:
+            columns['n_lag' + str(nlag)] = series.shift(nlag).values
+
+    names = list(columns)
+    matrix = np.empty((len(data), len(names)), dtype=np.float32)
+    for j, name in enumerate(names):
+        matrix[:, j] = columns[name]
+    return time.values, matrix, names
+
+
+def load_features(config=None, data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+    """
+    Notes: Feature matrix of build_features, cached on disk under a hash of the input data
+           and the configuration. A cached matrix is rebuilt as soon as either changes and
+           the stale entry of the same configuration is removed.
+    ----------
+    Parameters
+    ----------
+    config    : feature configuration, see DEFAULT_CONFIG (default=None, DEFAULT_CONFIG)
+    data_dir  : directory of the region csv files
+    cache_dir : directory of the cached matrices
+
+    Returns
+    -------
+    float32 dataframe indexed by time, usable as random forest input or SARIMAX exog
+    (drop the target column first)
+    """
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    key = feature_key(config, data_dir)
+    path = os.path.join(cache_dir, key)
+
+    if not os.path.exists(path + '.json'):
+        time, matrix, names = build_features(config, data_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        # remove the entry this configuration had before the data changed
+        for name in os.listdir(cache_dir):
+            if name.endswith('.json'):
+                with open(os.path.join(cache_dir, name)) as f:
+                    if json.load(f)['config'] == config:
+                        os.remove(os.path.join(cache_dir, name))
+                        for suffix in ('_time.npy', '_matrix.npy'):
+                            if os.path.exists(os.path.join(cache_dir, name[:-5] + suffix)):
+                                os.remove(os.path.join(cache_dir, name[:-5] + suffix))
+        np.save(path + '_time.npy', time.astype('datetime64[s]').astype(np.int64))
+        np.save(path + '_matrix.npy', matrix)
+        # written last, marks a complete entry
+        with open(path + '.json', 'w') as f:
+            json.dump({'config': config, 'columns': names}, f, indent=2)
+
+    with open(path + '.json') as f:
+        names = json.load(f)['columns']
+    time = pd.to_datetime(np.load(path + '_time.npy'), unit='s')
+    matrix = np.load(path + '_matrix.npy', mmap_mode='r')
+    return pd.DataFrame(matrix, index=pd.DatetimeIndex(time, name='time'), columns=names, copy=False)
+
+
+def build_ahead_features(config, time, history_time, history_target, columns):
+    """
+    Notes: Feature rows of time stamps beyond the data (eg. the day to forecast), built from the
+           time stamps and the history of the target only, in the columns of a cached matrix.
+           A lag reaching past the newest row of the history is taken whole days further back,
+           so lags of at least one day are always known.
+    ----------
+    Parameters
+    ----------
+    config         : feature configuration, see DEFAULT_CONFIG (without interconnector
+                     generation and solar exposure, which are not known ahead)
+    time           : time stamps of the rows
+    history_time   : evenly spaced time stamps of the history
+    history_target : target value of each history time stamp
+    columns        : columns of the matrix of load_features (the target column is left empty)
+
+    Returns
+    -------
+    float32 dataframe indexed by time with the columns of load_features
+    """
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    assert not config['inter_gen'] and not config['solar'], \
+        "Interconnector generation and solar exposure are not known ahead!"
+    time = pd.Series(pd.to_datetime(time))
+    history_time = pd.DatetimeIndex(history_time)
+    history_target = np.asarray(history_target, dtype=float)
+    interval = history_time[-1] - history_time[-2]
+    one_day = pd.Timedelta(days=1)
+
+    values = {'period': ((time - time.dt.normalize()) // interval + 1).values}
+    if config['calendar']:
+        values.update(_calendar_columns(time))
+    if config['fourier']:
+        fourier_terms = add_fourier_terms(time, *config['fourier'])
+        for name in fourier_terms.columns.drop('datetime'):
+            values[name] = fourier_terms[name].values
+    for name in columns:
+        if name.startswith('n_lag'):
+            source = time - int(name[len('n_lag'):]) * interval
+            late = source > history_time[-1]
+            source[late] -= np.ceil((source[late] - history_time[-1]) / one_day) * one_day
+            position = np.clip(history_time.searchsorted(source), 0, len(history_time) - 1)
+            found = history_time[position] == source
+            values[name] = np.where(found, history_target[position], np.nan)
+
+    target = config['target'] + '_' + config['region']
+    missing = [name for name in columns if name not in values and name != target]
+    assert not missing, "Columns %s cannot be built ahead!" % missing
+
+    matrix = np.full((len(time), len(columns)), np.nan, dtype=np.float32)
+    for j, name in enumerate(columns):
+        if name in values:
+            matrix[:, j] = values[name]
+    return pd.DataFrame(matrix, index=pd.DatetimeIndex(time, name='time'), columns=list(columns))
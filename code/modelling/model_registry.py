@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+REGISTRY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+DISK_BUDGET = 2 * 1024 ** 3  # bytes
+
+
+def data_hash(*data):
+    """
+    Notes: Content hash of training data (dataframes, series, arrays or anything json serialisable)
+    """
+    digest = hashlib.sha1()
+    for item in data:
+        if isinstance(item, (pd.DataFrame, pd.Series)):
+            digest.update(pd.util.hash_pandas_object(item, index=True).values.tobytes())
+            digest.update(json.dumps(list(map(str, item.columns if isinstance(item, pd.DataFrame)
+                                              else [item.name]))).encode())
+        elif isinstance(item, np.ndarray):
+            digest.update(str((item.dtype, item.shape)).encode())
+            digest.update(np.ascontiguousarray(item).tobytes())
+        else:
+            digest.update(json.dumps(item, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class LazyModel:
+    """
+    Notes: Stand-in for a registered model, unpickled on first use
+    """
+    def __init__(self, path):
+        self._path = path
+        self._model = None
+
+    def load(self):
+        if self._model is None:
+            with open(self._path, 'rb') as f:
+                self._model = pickle.load(f)
+        return self._model
+
+    def __getattr__(self, name):
+        # private and special names are never forwarded, copy and pickle look them up
+        # before __init__ has run
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+
+class ModelRegistry:
+    """
+    Notes: Fitted models serialised on disk under a hash of their name, training data,
+           feature configuration and hyperparameters. A hit skips training and loads the
+           model lazily; the least recently used entries are evicted when the registry
+           grows beyond the disk budget. Files are written to a temporary file and moved into
+           place, so registries of several processes never read half-written files, and a hit
+           only touches the model file instead of rewriting the index.
+    ----------
+    Parameters
+    ----------
+    registry_dir : directory of the serialised models
+    budget       : disk budget in bytes (default=2GB)
+    """
+    def __init__(self, registry_dir=REGISTRY_DIR, budget=DISK_BUDGET):
+        self.registry_dir = registry_dir
+        self.budget = budget
+        os.makedirs(registry_dir, exist_ok=True)
+        self._index_path = os.path.join(registry_dir, 'index.json')
+        self.index = self._load_index()
+
+    def key(self, name, data, config=None, params=None):
+        """
+        Notes: Registry key of a model
+        """
+        return data_hash(name, data_hash(*data), config, params)
+
+    def _path(self, key):
+        return os.path.join(self.registry_dir, key + '.pkl')
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path):
+            return {}
+        with open(self._index_path) as f:
+            return json.load(f)
+
+    def _replace(self, path, write, mode='w'):
+        """
+        Notes: Write a file through a temporary file in the registry, moved into place at once
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.registry_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode) as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _save_index(self):
+        self._replace(self._index_path, lambda f: json.dump(self.index, f, indent=2))
+
+    def _last_used(self, key):
+        # a hit touches the model file, the index holds the time it was registered
+        path = self._path(key)
+        return os.path.getmtime(path) if os.path.exists(path) else self.index[key]['last_used']
+
+    def get(self, key):
+        """
+        Notes: Lazily loaded model of a key, None if it is not registered
+        """
+        if key not in self.index:
+            # registered by another process since the index was read
+            self.index = self._load_index()
+        if key not in self.index or not os.path.exists(self._path(key)):
+            return None
+        os.utime(self._path(key))
+        return LazyModel(self._path(key))
+
+    def put(self, key, model, name=None):
+        """
+        Notes: Register a fitted model and evict the least recently used models over budget
+        """
+        self._replace(self._path(key), lambda f: pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL), 'wb')
+        # merge with what other processes registered in the meantime
+        self.index = self._load_index()
+        self.index[key] = {'name': name, 'size': os.path.getsize(self._path(key)), 'last_used': time.time()}
+        self.evict(keep=key)
+        self._save_index()
+        return model
+
+    def evict(self, keep=None):
+        """
+        Notes: Remove the least recently used models until the registry fits the disk budget
+        """
+        total = sum(entry['size'] for entry in self.index.values())
+        for key in sorted(self.index, key=self._last_used):
+            if total <= self.budget:
+                break
+            if key == keep:
+                continue
+            total -= self.index.pop(key)['size']
+            if os.path.exists(self._path(key)):
+                os.remove(self._path(key))
+
+    def fit(self, name, fit, data, config=None, params=None):
+        """
+        Notes: Registered model of the name, training data, feature configuration and
+               hyperparameters, only calling fit when there is none
+        ----------
+        Parameters
+        ----------
+        name   : name of the model, eg. 'vic_demand_rfr'
+        fit    : function fitting the model, called as fit(*data, **params)
+        data   : tuple of training data, eg. (X_train, y_train)
+        config : feature configuration the data was built with (default=None)
+        params : hyperparameters passed to fit (default=None)
+
+        Returns
+        -------
+        the fitted model (lazily loaded on a registry hit)
+        """
+        key = self.key(name, data, config, params)
+        model = self.get(key)
+        if model is None:
+            model = self.put(key, fit(*data, **(params or {})), name=name)
+        return model
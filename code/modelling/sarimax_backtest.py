@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+from tsa_utils import expanding_iqr_bounds
+
+import warnings
+warnings.filterwarnings("ignore")
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+PREDICTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'predictions')
+SPLITS = {'cv': ('2021-01-01 00:00:00', '2021-06-30 23:30:00'),
+          'test': ('2021-07-01 00:00:00', '2021-08-11 23:30:00')}
+
+# series shared by every block of a worker process
+_shared = {}
+
+
+def _init_worker(y, X):
+    """
+    Notes: Receive the series once per worker process instead of once per block
+    """
+    _shared['y'] = y
+    _shared['X'] = X
+
+
+def _run_block(first, days, one_day, order, params, bounds, refit=True):
+    """
+    Notes: Re-estimate the model on the history before the first day of the block starting
+           from params (or only filter the history with params when refit is False), then
+           forecast each day and extend the fitted state with its observations
+
+    Returns
+    -------
+    array of the days * one_day predictions and the estimated parameters
+    """
+    y, X = _shared['y'], _shared['X']
+
+    # we set lower and upper boundary so outliers won't affect our model too much,
+    # bounds[day] holds the boundaries of the history before each day
+    lower, upper = bounds[0]
+    model = SARIMAX(endog=np.clip(y[:first], lower, upper), exog=X[:first], order=order)
+    results = model.fit(start_params=params, disp=False) if refit else model.filter(params)
+    params = results.params
+
+    predictions = []
+    for day in range(days):
+        start, end = first + day * one_day, first + (day + 1) * one_day
+        predictions.append(results.forecast(steps=one_day, exog=X[start:end]))
+        if day < days - 1:
+            # filter the new observations only, keeping the fitted parameters
+            lower, upper = bounds[day + 1]
+            results = results.extend(np.clip(y[start:end], lower, upper), exog=X[start:end])
+    return np.concatenate(predictions), params
+
+
+def _run_blocks(args):
+    """
+    Notes: Run consecutive blocks in one worker, every re-estimation starts from the
+           parameters estimated for the block before it. The parameters of the first
+           block are already estimated when fitted is True.
+    """
+    blocks, one_day, order, params, fitted = args
+    predictions = []
+    for k, (first, days, bounds) in enumerate(blocks):
+        prediction, params = _run_block(first, days, one_day, order, params, bounds, refit=k > 0 or not fitted)
+        predictions.append(prediction)
+    return np.concatenate(predictions)
+
+
+def backtest(y, X, start, days, order=(1, 1, 1), refit_every=7, one_day=48, processes=None):
+    """
+    Notes: Rolling-origin backtest of SARIMAX day-ahead forecasts. The model is fitted once
+           on the history before the first day. The re-estimation days are split into one
+           run of consecutive days per worker process; within a run every re-estimation
+           starts from the parameters of the previous one (the first run reuses the initial
+           fit, the others start from its parameters). The days in between extend the
+           fitted state with the new observations instead of refitting on the whole history.
+    ----------
+    Parameters
+    ----------
+    y           : target series (eg. spot price)
+    X           : exogenous variables, one row per observation
+    start       : index of the first forecast period
+    days        : number of days to forecast
+    order       : (AR, I, MA) order of the model (default=(1, 1, 1))
+    refit_every : number of days between re-estimations (default=7, 1 refits every day)
+    one_day     : number of periods in one day (default=48)
+    processes   : number of worker processes (default=None, one per cpu)
+
+    Returns
+    -------
+    array of the days * one_day predictions
+    """
+    y = np.asarray(y, dtype=float)
+    X = np.asarray(X, dtype=float)
+
+    # expanding outlier boundaries of every day, tracked in a single pass
+    bounds = expanding_iqr_bounds(y, [start + day * one_day for day in range(days)])
+    lower, upper = bounds[0]
+    params = SARIMAX(endog=np.clip(y[:start], lower, upper), exog=X[:start], order=order).fit(disp=False).params
+
+    blocks = [(start + day * one_day, min(refit_every, days - day), bounds[day:day + refit_every])
+              for day in range(0, days, refit_every)]
+    runs = [list(run) for run in np.array_split(np.arange(len(blocks)), min(processes or os.cpu_count() or 1,
+                                                                            len(blocks)))]
+    jobs = [([blocks[k] for k in run], one_day, order, params, run[0] == 0) for run in runs]
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(y, X)) as pool:
+        return np.concatenate(list(pool.map(_run_blocks, jobs)))
+
+
+def run_backtest(region='vic', split='cv', exog=('inter_gen', 'demand'), order=(1, 1, 1), refit_every=7,
+                 one_day=48, processes=None, data_dir=DATA_DIR, prediction_dir=PREDICTION_DIR):
+    """
+    Notes: Backtest the spot price of one region over the cv or test period and write
+           predictions/{region}_spot_price_{split}_sarimax_{one_day}period.csv
+    ----------
+    Parameters
+    ----------
+    region         : one of 'vic', 'nsw', 'sa', 'tas'
+    split          : 'cv' or 'test'
+    exog           : exogenous columns of the region csv file
+    order          : (AR, I, MA) order of the model
+    refit_every    : number of days between re-estimations
+    one_day        : number of periods in one day (48 for half-hour data, 288 for 5-minute data)
+    processes      : number of worker processes
+    data_dir       : directory of the region csv files
+    prediction_dir : directory the predictions are written to
+
+    Returns
+    -------
+    dataframe with time, spot_price and predicted_spot_price
+    """
+    data = pd.read_csv(os.path.join(data_dir, region + '.csv'))
+    first, last = SPLITS[split]
+    start = int(np.searchsorted(data.time.values, first))
+    days = int(np.sum((data.time >= first) & (data.time <= last))) // one_day
+
+    predictions = backtest(data.spot_price, data[list(exog)], start, days, order=order,
+                           refit_every=refit_every, one_day=one_day, processes=processes)
+
+    result = data[['time', 'spot_price']][start:start + days * one_day].reset_index(drop=True)
+    result['predicted_spot_price'] = predictions
+    result.to_csv(os.path.join(prediction_dir, '%s_spot_price_%s_sarimax_%dperiod.csv' % (region, split, one_day)),
+                  index=False, header=True)
+    return result
+
+
+parser = argparse.ArgumentParser(description="Rolling-origin SARIMAX backtest of day-ahead spot price forecasts.")
+parser.add_argument("--region", metavar="R", type=str, default="vic",
+                    help="Region to backtest (default: vic).")
+parser.add_argument("--split", metavar="S", type=str, choices=list(SPLITS), default="cv",
+                    help="Period to backtest, 'cv' or 'test' (default: cv).")
+parser.add_argument("--refit-every", metavar="D", type=int, default=7,
+                    help="Number of days between re-estimations (default: 7).")
+parser.add_argument("--one-day", metavar="P", type=int, default=48,
+                    help="Number of periods in one day of the data (default: 48, 288 for 5-minute data).")
+parser.add_argument("--workers", metavar="N", type=int, default=None,
+                    help="Number of worker processes (default: one per cpu).")
+
+
+# Execute the codes only if this file is run as main.
+if __name__ == "__main__":
+    args = parser.parse_args()
+    result = run_backtest(args.region, args.split, refit_every=args.refit_every, one_day=args.one_day,
+                          processes=args.workers)
+    residuals = result.spot_price - result.predicted_spot_price
+    print('Root Mean Squared Error:', np.sqrt(np.mean(residuals ** 2)))
@@ -1,3 +1,5 @@
+import heapq
+import hashlib
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -76,25 +78,184 @@ def add_fourier_terms(datetime, year_k, week_k, day_k):
     day_k:  same as year_k but for daily periods
     """
     
-    df = pd.DataFrame({'datetime': datetime}).reset_index(drop=True)
-    df.datetime = pd.to_datetime(df.datetime)
-    
-    for k in range(1, year_k+1):
-        # year has a period of 365.25 including the leap year
-        df['year_sin'+str(k)] = np.sin(2 *k* np.pi * df.datetime.dt.dayofyear/365.25) 
-        df['year_cos'+str(k)] = np.cos(2 *k* np.pi * df.datetime.dt.dayofyear/365.25)
-
-    for k in range(1, week_k+1):
-        
-        # week has a period of 7
-        df['week_sin'+str(k)] = np.sin(2 *k* np.pi * df.datetime.dt.dayofweek/7)
-        df['week_cos'+str(k)] = np.cos(2 *k* np.pi * df.datetime.dt.dayofweek/7)
-
-
-    for k in range(1, day_k+1):
-        
-        # day has period of 24
-        df['hour_sin'+str(k)] = np.sin(2 *k* np.pi * df.datetime.dt.hour/24)
-        df['hour_cos'+str(k)] = np.cos(2 *k* np.pi * df.datetime.dt.hour/24) 
-    
-    return df
\ No newline at end of file
+    datetime = pd.Series(pd.to_datetime(datetime)).reset_index(drop=True)
+    terms = {'datetime': datetime}
+
+    # compute every term first and build the dataframe once
+    # year has a period of 365.25 including the leap year, week has a period of 7 and day has period of 24
+    for name, unit, period, n_terms in [('year', datetime.dt.dayofyear.values, 365.25, year_k),
+                                        ('week', datetime.dt.dayofweek.values, 7, week_k),
+                                        ('hour', datetime.dt.hour.values, 24, day_k)]:
+        for k in range(1, n_terms+1):
+            terms[name+'_sin'+str(k)] = np.sin(2 *k* np.pi * unit/period)
+            terms[name+'_cos'+str(k)] = np.cos(2 *k* np.pi * unit/period)
+
+    df = pd.DataFrame(terms)
+
+    return df
+
+
+class ExpandingQuantile:
+    """
+    Exact expanding-window quantiles with the same linear interpolation as pandas/numpy.
+    Each quantile keeps a max-heap holding the lowest floor((n-1)q)+1 values and a min-heap
+    holding the rest, so adding a value costs O(log n) and a query O(1).
+    quantiles: the quantiles to track, eg. (0.25, 0.75)
+    """
+
+    def __init__(self, quantiles=(0.25, 0.75)):
+        self.count = 0
+        self._heaps = {q: ([], []) for q in quantiles}
+
+    def update(self, values):
+        """
+        values: a new observation or an iterable of new observations (NaN is ignored)
+        """
+        for x in np.atleast_1d(np.asarray(values, dtype=float)).tolist():
+            if x != x:
+                continue
+            self.count += 1
+            for q, (lower, upper) in self._heaps.items():
+                if lower and x <= -lower[0]:
+                    heapq.heappush(lower, -x)
+                else:
+                    heapq.heappush(upper, x)
+                # rebalance so that lower holds the order statistics up to floor((n-1)q)
+                size = int(np.floor((self.count - 1) * q)) + 1
+                while len(lower) > size:
+                    heapq.heappush(upper, -heapq.heappop(lower))
+                while len(lower) < size:
+                    heapq.heappush(lower, -heapq.heappop(upper))
+        return self
+
+    def quantile(self, q):
+        """
+        q: one of the tracked quantiles
+        """
+        lower, upper = self._heaps[q]
+        if not lower:
+            return np.nan
+        h = (self.count - 1) * q
+        value = -lower[0]
+        if upper and h > np.floor(h):
+            value += (h - np.floor(h)) * (upper[0] - value)
+        return value
+
+    def iqr_bounds(self, k=1.5):
+        """
+        Lower and upper outlier boundaries, k IQR beyond the quartiles (needs 0.25 and 0.75 tracked)
+        """
+        q1, q3 = self.quantile(0.25), self.quantile(0.75)
+        return q1 - k * (q3 - q1), q3 + k * (q3 - q1)
+
+
+def expanding_iqr_bounds(timeseries, starts, k=1.5):
+    """
+    Outlier boundaries of the history before each start index, computed in a single pass
+    timeseries: the series to clip
+    starts: increasing indices, the boundaries of timeseries[:start] are returned for each start
+    k: number of IQR beyond the quartiles
+    """
+    values = np.asarray(timeseries, dtype=float)
+    tracker = ExpandingQuantile((0.25, 0.75))
+    bounds = []
+    seen = 0
+    for start in starts:
+        tracker.update(values[seen:start])
+        seen = start
+        bounds.append(tracker.iqr_bounds(k))
+    return bounds
+
+
+# autocorrelations already computed, keyed by a hash of the data and the arguments
+_correlation_cache = {}
+
+
+def _as_columns(data):
+    """
+    Columns of a series/dataframe/array as a 2-d float array and their names
+    """
+    if isinstance(data, pd.DataFrame):
+        return data.values.astype(float), list(data.columns)
+    if isinstance(data, pd.Series):
+        return data.values.astype(float)[:, None], [data.name]
+    values = np.asarray(data, dtype=float)
+    values = values[:, None] if values.ndim == 1 else values
+    return values, list(range(values.shape[1]))
+
+
+def _cached(kind, values, nlags, compute):
+    key = (kind, nlags, values.shape, hashlib.sha1(np.ascontiguousarray(values).tobytes()).hexdigest())
+    if key not in _correlation_cache:
+        _correlation_cache[key] = compute(values, nlags)
+    return _correlation_cache[key]
+
+
+def _autocovariance(values, nlags):
+    """
+    Sum of lagged products of the demeaned columns for lags 0..nlags, via FFT
+    """
+    n = len(values)
+    x = values - values.mean(axis=0)
+    size = 1 << int(np.ceil(np.log2(2 * n - 1)))
+    spectrum = np.fft.rfft(x, n=size, axis=0)
+    return np.fft.irfft(spectrum * np.conj(spectrum), n=size, axis=0)[:nlags+1]
+
+
+def _acf(values, nlags):
+    acov = _autocovariance(values, nlags)
+    return acov / acov[0]
+
+
+def _pacf(values, nlags):
+    # Yule-Walker with adjusted autocovariances (statsmodels 'ywadjusted'), solved for all
+    # orders at once by Durbin-Levinson
+    n = len(values)
+    acov = _autocovariance(values, nlags)
+    r = acov / np.concatenate([[n], n - np.arange(1, nlags+1)])[:, None]
+    r = r / r[0]
+    pacf = np.zeros_like(r)
+    pacf[0] = 1
+    phi = np.zeros((0, r.shape[1]))
+    for k in range(1, nlags+1):
+        phi_kk = (r[k] - (phi * r[k-1:0:-1]).sum(axis=0)) / (1 - (phi * r[1:k]).sum(axis=0))
+        phi = np.vstack([phi - phi_kk * phi[::-1], phi_kk])
+        pacf[k] = phi_kk
+    return pacf
+
+
+def fast_acf(data, nlags=48):
+    """
+    Autocorrelation of every column for lags 0..nlags computed via FFT (same as statsmodels acf), cached
+    data: series, dataframe or array with one column per series (eg. several columns and regions)
+    nlags: the number of lags
+    """
+    values, names = _as_columns(data)
+    return pd.DataFrame(_cached('acf', values, nlags, _acf), columns=names)
+
+
+def fast_pacf(data, nlags=48):
+    """
+    Partial autocorrelation of every column for lags 0..nlags by Durbin-Levinson on the FFT
+    autocovariances (same as statsmodels pacf with method='ywadjusted'), cached
+    data: series, dataframe or array with one column per series
+    nlags: the number of lags
+    """
+    values, names = _as_columns(data)
+    return pd.DataFrame(_cached('pacf', values, nlags, _pacf), columns=names)
+
+
+def select_lags(data, nlags=144, min_lag=48, top=5, method='pacf'):
+    """
+    Lags from min_lag up to nlags (excluded) with the highest absolute correlation for every column
+    data: series, dataframe or array with one column per series
+    method: 'pacf' or 'acf'
+    return: dictionary of column name -> list of lags, most correlated first
+    """
+    correlation = (fast_pacf if method == 'pacf' else fast_acf)(data, nlags=nlags)
+    lags = np.arange(min_lag, nlags)
+    selected = {}
+    for name in correlation.columns:
+        order = np.argsort(-np.abs(correlation[name].values[min_lag:nlags]), kind='stable')
+        selected[name] = lags[order[:top]].tolist()
+    return selected
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+import os
+import json
+import argparse
+
+import numpy as np
+import pandas as pd
+
+REGIONS = ['vic', 'nsw', 'sa', 'tas']
+COLUMNS = ['spot_price', 'inter_gen', 'demand', 'period']
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+STORE_DIR = os.path.join(DATA_DIR, 'store')
+
+# same split dates as Preprocessing.ipynb, stored as index ranges
+SPLITS = {'train': (None, '2020-12-31 23:30:00'),
+          'cv': ('2021-01-01 00:00:00', '2021-06-30 23:30:00'),
+          'test': ('2021-07-01 00:00:00', '2021-08-11 23:30:00')}
+
+
+def _epoch(time):
+    """
+    Notes: Convert time stamps to int64 seconds since epoch
+    """
+    return np.asarray(pd.to_datetime(time), dtype='datetime64[s]').astype(np.int64)
+
+
+def convert(data_dir=DATA_DIR, store_dir=STORE_DIR, regions=REGIONS):
+    """
+    Notes: One-time conversion of the region csv files into a columnar binary store:
+           a shared int64 epoch time column, one float32 .npy file per region and
+           column, and meta.json with the train/cv/test splits as index ranges.
+    ----------
+    Parameters
+    ----------
+    data_dir  : directory of the region csv files
+    store_dir : directory the store is written to
+    regions   : regions to convert
+
+    Returns
+    -------
+    meta data of the store
+    """
+    time = None
+    for region in regions:
+        data = pd.read_csv(os.path.join(data_dir, region + '.csv'))
+        epoch = _epoch(data.time)
+        if time is None:
+            time = epoch
+            os.makedirs(store_dir, exist_ok=True)
+            np.save(os.path.join(store_dir, 'time.npy'), time)
+        assert np.array_equal(time, epoch), "Regions must share the same time stamps!"
+        os.makedirs(os.path.join(store_dir, region), exist_ok=True)
+        for column in COLUMNS:
+            np.save(os.path.join(store_dir, region, column + '.npy'), data[column].values.astype(np.float32))
+
+    splits = {}
+    for name, (start, end) in SPLITS.items():
+        splits[name] = [int(np.searchsorted(time, _epoch([start])[0], side='left')) if start else 0,
+                        int(np.searchsorted(time, _epoch([end])[0], side='right')) if end else len(time)]
+
+    meta = {'regions': list(regions), 'columns': COLUMNS, 'length': len(time), 'splits': splits}
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class DataStore:
+    """
+    Notes: Memory-mapped columnar store written by convert. Slices are views of the
+           mapped files, nothing is read from disk until the values are used.
+    ----------
+    Parameters
+    ----------
+    store_dir : directory of the store
+    """
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.regions = self.meta['regions']
+        self.columns = self.meta['columns']
+        self.splits = {name: tuple(rows) for name, rows in self.meta['splits'].items()}
+        self.time = np.load(os.path.join(store_dir, 'time.npy'), mmap_mode='r')
+        self._columns = {}
+
+    def column(self, region, column):
+        """
+        Notes: Whole memory-mapped column of a region
+        """
+        key = (region, column)
+        if key not in self._columns:
+            self._columns[key] = np.load(os.path.join(self.store_dir, region, column + '.npy'), mmap_mode='r')
+        return self._columns[key]
+
+    def rows(self, split=None, start=None, end=None):
+        """
+        Notes: Index range of a split and/or date range (both ends of the date range included)
+        """
+        first, last = self.splits[split] if split is not None else (0, len(self.time))
+        if start is not None:
+            first = max(first, int(np.searchsorted(self.time, _epoch([start])[0], side='left')))
+        if end is not None:
+            last = min(last, int(np.searchsorted(self.time, _epoch([end])[0], side='right')))
+        return first, max(first, last)
+
+    def load(self, region, columns=None, split=None, start=None, end=None):
+        """
+        Notes: Zero-copy slices of a region
+        ----------
+        Parameters
+        ----------
+        region  : one of the stored regions
+        columns : list of columns (default=None, all columns)
+        split   : 'train', 'cv' or 'test' (default=None, whole data set)
+        start   : first time stamp to include (default=None)
+        end     : last time stamp to include (default=None)
+
+        Returns
+        -------
+        dictionary of arrays, 'time' holds the epoch seconds
+        """
+        first, last = self.rows(split, start, end)
+        result = {'time': self.time[first:last]}
+        for column in columns or self.columns:
+            result[column] = self.column(region, column)[first:last]
+        return result
+
+    def frame(self, region, columns=None, split=None, start=None, end=None):
+        """
+        Notes: Same as load but as a dataframe with a parsed time column (copies the slice)
+        """
+        data = self.load(region, columns, split, start, end)
+        data['time'] = pd.to_datetime(data['time'], unit='s')
+        return pd.DataFrame(data)
+
+
+parser = argparse.ArgumentParser(description="Convert the region csv files into a memory-mapped columnar store.")
+parser.add_argument("--data", metavar="DIR", type=str, default=DATA_DIR,
+                    help="Directory of the region csv files.")
+parser.add_argument("--store", metavar="OUT", type=str, default=STORE_DIR,
+                    help="Directory where the store should be written.")
+
+
+# Execute the codes only if this file is run as main.
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print(convert(args.data, args.store))
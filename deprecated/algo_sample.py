@@ -142,6 +142,63 @@ def std_mean(ser, num, direction):
     return np.mean(ser)+direction*num*np.std(ser)
 
 
+def forward_windows(spot_price, window):
+    """
+    Notes: Look-ahead windows of the series, row i holds the next `window` prices after i
+           (the same windows as spot_price[::-1].shift(1).rolling(window)), sorted
+    """
+    values = np.asarray(spot_price, dtype=float)
+    if len(values) <= window:
+        return np.empty((0, window)), np.empty((0, window))
+    view = np.lib.stride_tricks.sliding_window_view(values[1:], window)
+    return view, np.sort(view, axis=1)
+
+
+def forward_quantiles(spot_price, specs, method='linear'):
+    """
+    Notes: All look-ahead quantiles of several timeframes at once. The windows of each size
+           are sorted once and every quantile of that size is read from the sorted windows.
+    ----------
+    Parameters
+    ----------
+    spot_price : spot price series
+    specs      : dictionary of window -> list of quantiles, eg. {8: [0.1, 0.8], 24: [0.05, 0.9]}
+    method     : 'linear' (pandas rolling quantile) or 'exclusive' (excel, see quantile_exc)
+
+    Returns
+    -------
+    dictionary of (window, quantile) -> array, NaN where fewer than window prices are ahead
+    """
+    n = len(spot_price)
+    result = {}
+    for window, quantiles in specs.items():
+        _, ordered = forward_windows(spot_price, window)
+        for q in quantiles:
+            if method == 'exclusive':
+                rank = q * (window + 1) - 1
+                assert rank > 0, 'quantile is too small'
+                assert int(rank) + 1 < window, 'quantile is too large'
+            else:
+                rank = q * (window - 1)
+            rank_l = int(rank)
+            value = ordered[:, rank_l]
+            if rank != rank_l:
+                value = value + (ordered[:, rank_l + 1] - value) * (rank - rank_l)
+            result[(window, q)] = np.concatenate([value, np.full(n - len(value), np.nan)])
+    return result
+
+
+def forward_mean_std(spot_price, window, num=1):
+    """
+    Notes: Look-ahead mean minus and plus num standard deviations (see std_mean)
+    """
+    n = len(spot_price)
+    view, _ = forward_windows(spot_price, window)
+    mean, std = view.mean(axis=1), view.std(axis=1)
+    pad = np.full(n - len(mean), np.nan)
+    return np.concatenate([mean - num * std, pad]), np.concatenate([mean + num * std, pad])
+
+
 def calc_forecast(spot_price, window=10, lower_pctl=0.25, upper_pctl=0.75, method=1, name='spot_price', show=False):
     """
     ----------
@@ -162,15 +219,13 @@ def calc_forecast(spot_price, window=10, lower_pctl=0.25, upper_pctl=0.75, metho
     
     df = pd.DataFrame({'spot_price': spot_price}).reset_index()
     
-    if method == 1:
-        df['lower'] = df.spot_price[::-1].shift(1).rolling(window).apply(lambda x: quantile_exc(x, lower_pctl))
-        df['upper'] = df.spot_price[::-1].shift(1).rolling(window).apply(lambda x: quantile_exc(x, upper_pctl))
-    elif method == 2:
-        df['lower'] = df.spot_price[::-1].shift(1).rolling(window).quantile(lower_pctl, interpolation='linear')
-        df['upper'] = df.spot_price[::-1].shift(1).rolling(window).quantile(upper_pctl, interpolation='linear')
+    if method in (1, 2):
+        bounds = forward_quantiles(df.spot_price, {window: [lower_pctl, upper_pctl]},
+                                   method='exclusive' if method == 1 else 'linear')
+        df['lower'] = bounds[(window, lower_pctl)]
+        df['upper'] = bounds[(window, upper_pctl)]
     elif method == 3:
-        df['lower'] = df.spot_price[::-1].shift(1).rolling(window).apply(lambda x: std_mean(x, 1, -1))
-        df['upper'] = df.spot_price[::-1].shift(1).rolling(window).apply(lambda x: std_mean(x, 1, +1))
+        df['lower'], df['upper'] = forward_mean_std(df.spot_price, window, 1)
 
     df['forecast'] = np.where(
         df['spot_price'] < df['lower'], -1, np.where(
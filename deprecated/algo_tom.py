@@ -23,48 +23,25 @@ def calc_forecast_tom_1(spot_price, small=[8, 0.1, 0.8], medium=[12, 0.25, 0.75]
 
     df = pd.DataFrame(spot_price, columns=['spot_price'])
 
-    # Small time frame
-    window_s = small[0]
-    lower_pctl_s = small[1]
-    upper_pctl_s = small[2]
-    df['lower_s'] = df.spot_price[::-
-                                  1].shift(1).rolling(window_s).quantile(lower_pctl_s)  # window=6, 0.10
-    df['upper_s'] = df.spot_price[::-
-                                  1].shift(1).rolling(window_s).quantile(upper_pctl_s)  # window=6, 0.90
-    # for last window_s
-    df['lower_s'][-window_s::] = df.spot_price[-window_s:                                               :].quantile(lower_pctl_s, interpolation='linear')
-    df['upper_s'][-window_s::] = df.spot_price[-window_s:                                               :].quantile(upper_pctl_s, interpolation='linear')
+    # quantiles of all timeframes in one go
+    specs = {}
+    for window, lower_pctl, upper_pctl in (small, medium, large):
+        specs.setdefault(window, []).extend([lower_pctl, upper_pctl])
+    bounds = forward_quantiles(df.spot_price, specs)
+
+    for suffix, (window, lower_pctl, upper_pctl) in zip(['s', 'm', 'l'], [small, medium, large]):
+        lower = bounds[(window, lower_pctl)]
+        upper = bounds[(window, upper_pctl)]
+        # for last window
+        lower[-window:] = df.spot_price[-window:].quantile(lower_pctl, interpolation='linear')
+        upper[-window:] = df.spot_price[-window:].quantile(upper_pctl, interpolation='linear')
+        df['lower_' + suffix] = lower
+        df['upper_' + suffix] = upper
 
     df['forecast_s'] = np.where((df.spot_price < df.lower_s), -1, np.where(
                                 (df.spot_price > df.upper_s), 1, 0))
-
-    # Medium timeframe
-    window_m = medium[0]
-    lower_pctl_m = medium[1]
-    upper_pctl_m = medium[2]
-    df['lower_m'] = df.spot_price[::-
-                                  1].shift(1).rolling(window_m).quantile(lower_pctl_m)  # window=12, 0.20
-    df['upper_m'] = df.spot_price[::-
-                                  1].shift(1).rolling(window_m).quantile(upper_pctl_m)  # window=12, 0.80
-    # for last window_m
-    df['lower_m'][-window_m::] = df.spot_price[-window_m:                                               :].quantile(lower_pctl_m)
-    df['upper_m'][-window_m::] = df.spot_price[-window_m:                                               :].quantile(upper_pctl_m)
-
     df['forecast_m'] = np.where((df.spot_price <= df.lower_m), -1, np.where(
                                 (df.spot_price >= df.upper_m), 1, 0))
-
-    # Large timeframe
-    window_l = large[0]
-    lower_pctl_l = large[1]
-    upper_pctl_l = large[2]
-    df['lower_l'] = df.spot_price[::-
-                                  1].shift(1).rolling(window_l).quantile(lower_pctl_l)  # window=24, 0.05
-    df['upper_l'] = df.spot_price[::-
-                                  1].shift(1).rolling(window_l).quantile(upper_pctl_l)  # window=24, 0.95
-    # for last window_l
-    df['lower_l'][-window_l::] = df.spot_price[-window_l:                                               :].quantile(lower_pctl_l)
-    df['upper_l'][-window_l::] = df.spot_price[-window_l:                                               :].quantile(upper_pctl_l)
-
     df['forecast_l'] = np.where((df.spot_price < df.lower_l), -1, np.where(
                                 (df.spot_price > df.upper_l), 1, 0))
 